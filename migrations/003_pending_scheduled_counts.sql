@@ -0,0 +1,34 @@
+-- ============================================================================
+-- Migration: Pending scheduled messages + undelivered count in one query
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- Returns due messages with their order embedded (same shape as the PostgREST
+-- embed "cupido_orders") plus how many messages of that order are still
+-- undelivered, so the scheduler can decide completion without an N+1.
+CREATE OR REPLACE FUNCTION get_pending_scheduled_with_counts(p_now TIMESTAMPTZ)
+RETURNS SETOF JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT to_jsonb(m) || jsonb_build_object(
+        'cupido_orders', jsonb_build_object(
+            'id', o.id,
+            'plan', o.plan,
+            'recipient_phone', o.recipient_phone,
+            'buyer_phone', o.buyer_phone,
+            'messages_sent', o.messages_sent,
+            'status', o.status
+        ),
+        'undelivered_count', (
+            SELECT COUNT(*) FROM cupido_messages u
+            WHERE u.order_id = m.order_id AND u.delivered = FALSE
+        )
+    )
+    FROM cupido_messages m
+    JOIN cupido_orders o ON o.id = m.order_id
+    WHERE m.delivered = FALSE
+      AND m.scheduled_at IS NOT NULL
+      AND m.scheduled_at <= p_now
+    ORDER BY m.scheduled_at;
+$$;
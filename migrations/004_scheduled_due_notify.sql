@@ -0,0 +1,45 @@
+-- ============================================================================
+-- Migration: Push due scheduled messages to the API via LISTEN/NOTIFY
+-- Run this in Supabase SQL Editor (pg_cron must be enabled: Database > Extensions)
+-- ============================================================================
+
+-- Notify channel "scheduled_due" with the id of every message that is due now
+CREATE OR REPLACE FUNCTION notify_due_scheduled_messages()
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    SELECT pg_notify('scheduled_due', m.id::text)
+    FROM cupido_messages m
+    WHERE m.delivered = FALSE
+      AND m.scheduled_at IS NOT NULL
+      AND m.scheduled_at <= NOW();
+$$;
+
+-- Rows that become due through an UPDATE (reschedule into the past, retry reset).
+-- INSERTs are left out on purpose: a message submitted with a past/current
+-- scheduled_at is delivered inline by the form route, notifying would double-send.
+CREATE OR REPLACE FUNCTION cupido_messages_notify_due()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.delivered = FALSE
+       AND NEW.scheduled_at IS NOT NULL
+       AND NEW.scheduled_at <= NOW() THEN
+        PERFORM pg_notify('scheduled_due', NEW.id::text);
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_cupido_messages_notify_due ON cupido_messages;
+CREATE TRIGGER trg_cupido_messages_notify_due
+AFTER UPDATE OF scheduled_at, delivered ON cupido_messages
+FOR EACH ROW EXECUTE FUNCTION cupido_messages_notify_due();
+
+-- Future-dated messages: notify once per minute when they come due
+SELECT cron.schedule(
+    'cupido-notify-due',
+    '* * * * *',
+    'SELECT notify_due_scheduled_messages()'
+);
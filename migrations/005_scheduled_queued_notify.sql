@@ -0,0 +1,30 @@
+-- ============================================================================
+-- Migration: Announce newly scheduled messages via LISTEN/NOTIFY
+-- The API keeps them in an in-process priority queue and delivers each one
+-- at its scheduled_at, instead of waiting for the next per-minute tick.
+-- Run this in Supabase SQL Editor (after 004)
+-- ============================================================================
+
+-- Notify channel "scheduled_queued" with {"id", "scheduled_at"} whenever a
+-- message is scheduled (or rescheduled) into the future
+CREATE OR REPLACE FUNCTION cupido_messages_notify_queued()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.delivered = FALSE
+       AND NEW.scheduled_at IS NOT NULL
+       AND NEW.scheduled_at > NOW() THEN
+        PERFORM pg_notify(
+            'scheduled_queued',
+            json_build_object('id', NEW.id, 'scheduled_at', NEW.scheduled_at)::text
+        );
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_cupido_messages_notify_queued ON cupido_messages;
+CREATE TRIGGER trg_cupido_messages_notify_queued
+AFTER INSERT OR UPDATE OF scheduled_at ON cupido_messages
+FOR EACH ROW EXECUTE FUNCTION cupido_messages_notify_queued();
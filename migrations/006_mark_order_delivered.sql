@@ -0,0 +1,22 @@
+-- ============================================================================
+-- Migration: Close an order server-side once all its messages are delivered
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- Sets status/delivered_at (DB clock) only when no message of the order is
+-- still undelivered; the check and the update run in one statement.
+-- Returns the updated order, or no row when messages are still pending.
+CREATE OR REPLACE FUNCTION mark_order_delivered(p_id UUID)
+RETURNS SETOF cupido_orders
+LANGUAGE sql
+AS $$
+    UPDATE cupido_orders o
+    SET status = 'delivered',
+        delivered_at = NOW()
+    WHERE o.id = p_id
+      AND NOT EXISTS (
+          SELECT 1 FROM cupido_messages m
+          WHERE m.order_id = p_id AND m.delivered = FALSE
+      )
+    RETURNING o.*;
+$$;
@@ -0,0 +1,95 @@
+-- ============================================================================
+-- Migration: Form submissions as single-transaction RPCs
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- One message of the (multi-)message flow: inserts the message at the next
+-- index, bumps messages_sent, stores the recipient and - for the last message
+-- when it is scheduled - marks the order submitted. The order row is locked,
+-- so concurrent submits can't both take the last slot.
+-- Returns {"message": <row>, "order": <row>}, or NULL when no message is left.
+CREATE OR REPLACE FUNCTION submit_message(
+    p_order_id UUID,
+    p_recipient TEXT,
+    p_content TEXT,
+    p_nickname TEXT,
+    p_audio_text TEXT,
+    p_scheduled_at TIMESTAMPTZ,
+    p_max_messages INT
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_order cupido_orders;
+    v_message cupido_messages;
+    v_sent INT;
+BEGIN
+    SELECT * INTO v_order FROM cupido_orders WHERE id = p_order_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    v_sent := COALESCE(v_order.messages_sent, 0);
+    IF v_sent >= p_max_messages THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO cupido_messages (
+        order_id, message_index, content, sender_nickname, audio_text, scheduled_at, delivered
+    )
+    VALUES (p_order_id, v_sent, p_content, p_nickname, p_audio_text, p_scheduled_at, FALSE)
+    RETURNING * INTO v_message;
+
+    UPDATE cupido_orders
+    SET recipient_phone = p_recipient,
+        messages_sent = v_sent + 1,
+        status = CASE
+            WHEN v_sent + 1 >= p_max_messages AND p_scheduled_at > NOW() THEN 'submitted'
+            ELSE status
+        END
+    WHERE id = p_order_id
+    RETURNING * INTO v_order;
+
+    RETURN jsonb_build_object('message', to_jsonb(v_message), 'order', to_jsonb(v_order));
+END;
+$$;
+
+-- Premium: presentation + its message entry + order submitted, in one go.
+-- Returns {"presentation": <row>, "order": <row>}, or NULL when the order was
+-- already submitted/delivered.
+CREATE OR REPLACE FUNCTION submit_premium(
+    p_order_id UUID,
+    p_recipient TEXT,
+    p_title TEXT,
+    p_slides JSONB,
+    p_nickname TEXT,
+    p_audio_text TEXT
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_order cupido_orders;
+    v_presentation cupido_presentations;
+BEGIN
+    UPDATE cupido_orders
+    SET recipient_phone = p_recipient,
+        status = 'submitted'
+    WHERE id = p_order_id
+      AND status NOT IN ('submitted', 'delivered')
+    RETURNING * INTO v_order;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO cupido_presentations (order_id, title, slides)
+    VALUES (p_order_id, p_title, p_slides)
+    RETURNING * INTO v_presentation;
+
+    INSERT INTO cupido_messages (order_id, message_index, content, sender_nickname, audio_text, delivered)
+    VALUES (p_order_id, 0, p_title, p_nickname, p_audio_text, FALSE);
+
+    RETURN jsonb_build_object('presentation', to_jsonb(v_presentation), 'order', to_jsonb(v_order));
+END;
+$$;
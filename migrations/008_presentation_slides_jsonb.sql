@@ -0,0 +1,10 @@
+-- ============================================================================
+-- Migration: Normalize presentation slides stored as a JSON string
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- slides is JSONB, but older inserts stored the array as a JSON *string*
+-- ("[{...}]"). Unwrap those so PostgREST always returns a decoded array.
+UPDATE cupido_presentations
+SET slides = (slides #>> '{}')::jsonb
+WHERE jsonb_typeof(slides) = 'string';
@@ -0,0 +1,15 @@
+-- ============================================================================
+-- Migration: Batched presentation view counts
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- Adds buffered views in one statement: p_counts = {"<presentation_id>": n, ...}
+CREATE OR REPLACE FUNCTION bump_view_counts(p_counts JSONB)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    UPDATE cupido_presentations p
+    SET view_count = COALESCE(p.view_count, 0) + c.value::INT
+    FROM jsonb_each_text(p_counts) c
+    WHERE p.id = c.key::UUID;
+$$;
@@ -0,0 +1,25 @@
+-- ============================================================================
+-- Migration: Create a fidelidade test and its first message in one call
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- Inserts the pending test and its outbound first message in one transaction
+-- (no test without its message). Returns the created test.
+CREATE OR REPLACE FUNCTION create_test_with_message(
+    p_user_id UUID,
+    p_target_phone TEXT,
+    p_message TEXT
+)
+RETURNS SETOF fidelidade_tests
+LANGUAGE sql
+AS $$
+    WITH test AS (
+        INSERT INTO fidelidade_tests (user_id, target_phone, first_message, status)
+        VALUES (p_user_id, p_target_phone, p_message, 'pending')
+        RETURNING *
+    ), message AS (
+        INSERT INTO fidelidade_messages (test_id, direction, content)
+        SELECT id, 'outbound', p_message FROM test
+    )
+    SELECT * FROM test;
+$$;
@@ -0,0 +1,24 @@
+-- ============================================================================
+-- Migration: Expire a user's overdue tests and list them in one call
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- Flips the user's active tests past expires_at (DB clock) to 'expired', then
+-- returns all of the user's tests, newest first, with the new statuses.
+CREATE OR REPLACE FUNCTION expire_and_list_tests(p_user_id UUID)
+RETURNS SETOF fidelidade_tests
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE fidelidade_tests
+    SET status = 'expired'
+    WHERE user_id = p_user_id
+      AND status = 'active'
+      AND expires_at < NOW();
+
+    RETURN QUERY
+    SELECT * FROM fidelidade_tests
+    WHERE user_id = p_user_id
+    ORDER BY created_at DESC;
+END;
+$$;
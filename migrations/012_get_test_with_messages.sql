@@ -0,0 +1,24 @@
+-- ============================================================================
+-- Migration: Load a fidelidade test and its messages in one call
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- Returns the test as JSON with its messages (oldest first) under "messages",
+-- or NULL when the test doesn't exist or belongs to another user.
+CREATE OR REPLACE FUNCTION get_test_with_messages(p_test_id UUID, p_user_id UUID)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT to_jsonb(t) || jsonb_build_object(
+        'messages',
+        COALESCE(
+            jsonb_agg(to_jsonb(m) ORDER BY m.created_at) FILTER (WHERE m.id IS NOT NULL),
+            '[]'::jsonb
+        )
+    )
+    FROM fidelidade_tests t
+    LEFT JOIN fidelidade_messages m ON m.test_id = t.id
+    WHERE t.id = p_test_id AND t.user_id = p_user_id
+    GROUP BY t.id;
+$$;
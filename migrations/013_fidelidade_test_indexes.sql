@@ -0,0 +1,16 @@
+-- ============================================================================
+-- Migration: Indexes for the fidelidade test lookups
+-- Run this in Supabase SQL Editor
+-- CONCURRENTLY can't run inside a transaction: run each statement on its own.
+-- ============================================================================
+
+-- Inbound WhatsApp replies: latest pending/active test for a target phone
+-- (handle_inbound_message). Partial, so closed tests never enter the index.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_fidelidade_tests_phone_open
+ON fidelidade_tests(target_phone, status, created_at DESC)
+WHERE status IN ('pending', 'active');
+
+-- Payment activation (latest pending test per user) and the per-user test
+-- list / expiry sweep (expire_and_list_tests)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_fidelidade_tests_user_status
+ON fidelidade_tests(user_id, status, created_at DESC);
@@ -0,0 +1,60 @@
+-- ============================================================================
+-- Migration: Fidelidade signups as one call (existence check + insert)
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- Each function takes a transaction-scoped advisory lock on its lookup key, so
+-- two concurrent signups for the same email/phone can't both insert.
+
+-- Register: creates the user unless the email is taken.
+-- created = FALSE means the email already exists (user_id is that user).
+CREATE OR REPLACE FUNCTION register_fidelidade_user(
+    p_nome TEXT,
+    p_email TEXT,
+    p_telefone TEXT,
+    p_senha_hash TEXT
+)
+RETURNS TABLE (user_id UUID, created BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('fidelidade_users:email:' || p_email));
+
+    RETURN QUERY
+    SELECT u.id, FALSE FROM fidelidade_users u WHERE u.email = p_email LIMIT 1;
+    IF FOUND THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    INSERT INTO fidelidade_users (nome, email, telefone, senha_hash)
+    VALUES (p_nome, p_email, p_telefone, p_senha_hash)
+    RETURNING id, TRUE;
+END;
+$$;
+
+-- Quick test: reuses the user with this phone, or creates one.
+CREATE OR REPLACE FUNCTION find_or_create_fidelidade_user_by_phone(
+    p_nome TEXT,
+    p_telefone TEXT,
+    p_email TEXT,
+    p_senha_hash TEXT
+)
+RETURNS TABLE (user_id UUID, created BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('fidelidade_users:telefone:' || p_telefone));
+
+    RETURN QUERY
+    SELECT u.id, FALSE FROM fidelidade_users u WHERE u.telefone = p_telefone LIMIT 1;
+    IF FOUND THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    INSERT INTO fidelidade_users (nome, email, telefone, senha_hash)
+    VALUES (p_nome, p_email, p_telefone, p_senha_hash)
+    RETURNING id, TRUE;
+END;
+$$;
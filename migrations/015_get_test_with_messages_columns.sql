@@ -0,0 +1,34 @@
+-- ============================================================================
+-- Migration: Project only the chat columns in get_test_with_messages
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- Same contract as 012, minus the columns the chat never reads: the test
+-- carries id/status/expires_at, each message id/direction/content/created_at.
+CREATE OR REPLACE FUNCTION get_test_with_messages(p_test_id UUID, p_user_id UUID)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT jsonb_build_object(
+        'id', t.id,
+        'status', t.status,
+        'expires_at', t.expires_at,
+        'messages', COALESCE(
+            jsonb_agg(
+                jsonb_build_object(
+                    'id', m.id,
+                    'direction', m.direction,
+                    'content', m.content,
+                    'created_at', m.created_at
+                )
+                ORDER BY m.created_at
+            ) FILTER (WHERE m.id IS NOT NULL),
+            '[]'::jsonb
+        )
+    )
+    FROM fidelidade_tests t
+    LEFT JOIN fidelidade_messages m ON m.test_id = t.id
+    WHERE t.id = p_test_id AND t.user_id = p_user_id
+    GROUP BY t.id;
+$$;
@@ -0,0 +1,52 @@
+-- ============================================================================
+-- Migration: Keyset-paginated pending scheduled messages
+-- Run this in Supabase SQL Editor
+-- CONCURRENTLY can't run inside a transaction: run the index statements on their own.
+-- ============================================================================
+
+-- Due messages with their order embedded (same shape as the PostgREST embed
+-- "cupido_orders"), in pages of p_limit ordered by (scheduled_at, id). The next
+-- page starts after the last row seen (p_after_at, p_after_id); pass NULLs for
+-- the first page. Messages that fail to deliver stay undelivered, so paging by
+-- key (not by OFFSET or "fetch until empty") is what keeps a tick from re-reading
+-- them. Nothing reads a per-order undelivered count, so none is computed here.
+CREATE OR REPLACE FUNCTION get_due_scheduled_messages(
+    p_now TIMESTAMPTZ,
+    p_limit INT,
+    p_after_at TIMESTAMPTZ DEFAULT NULL,
+    p_after_id UUID DEFAULT NULL
+)
+RETURNS SETOF JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT to_jsonb(m) || jsonb_build_object(
+        'cupido_orders', jsonb_build_object(
+            'id', o.id,
+            'plan', o.plan,
+            'recipient_phone', o.recipient_phone,
+            'buyer_phone', o.buyer_phone,
+            'messages_sent', o.messages_sent,
+            'status', o.status
+        )
+    )
+    FROM cupido_messages m
+    JOIN cupido_orders o ON o.id = m.order_id
+    WHERE m.delivered = FALSE
+      AND m.scheduled_at IS NOT NULL
+      AND m.scheduled_at <= p_now
+      AND (p_after_at IS NULL OR (m.scheduled_at, m.id) > (p_after_at, p_after_id))
+    ORDER BY m.scheduled_at, m.id
+    LIMIT p_limit;
+$$;
+
+-- Replaced by get_due_scheduled_messages (unpaged version from 003)
+DROP FUNCTION IF EXISTS get_pending_scheduled_with_counts(TIMESTAMPTZ);
+
+-- Partial index matching the page order; supersedes idx_cupido_messages_scheduled
+-- (002), which only covered scheduled_at
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cupido_messages_due
+ON cupido_messages(scheduled_at, id)
+WHERE delivered = FALSE AND scheduled_at IS NOT NULL;
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_cupido_messages_scheduled;
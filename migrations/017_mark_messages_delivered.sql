@@ -0,0 +1,36 @@
+-- ============================================================================
+-- Migration: Mark a batch of messages delivered and close finished orders
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- p_messages: [{"id": "<message uuid>", "audio_url": "<url or null>"}, ...]
+-- Flags every listed message delivered (setting audio_url when given), then
+-- closes their orders that have no undelivered message left, like
+-- mark_order_delivered (006). Returns the orders it closed.
+CREATE OR REPLACE FUNCTION mark_messages_delivered(p_messages JSONB)
+RETURNS SETOF cupido_orders
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE cupido_messages m
+    SET delivered = TRUE,
+        audio_url = COALESCE(v.audio_url, m.audio_url)
+    FROM jsonb_to_recordset(p_messages) AS v(id UUID, audio_url TEXT)
+    WHERE m.id = v.id;
+
+    RETURN QUERY
+    UPDATE cupido_orders o
+    SET status = 'delivered',
+        delivered_at = NOW()
+    WHERE o.id IN (
+          SELECT m.order_id FROM cupido_messages m
+          WHERE m.id IN (SELECT (e->>'id')::UUID FROM jsonb_array_elements(p_messages) e)
+      )
+      AND o.status <> 'delivered'
+      AND NOT EXISTS (
+          SELECT 1 FROM cupido_messages u
+          WHERE u.order_id = o.id AND u.delivered = FALSE
+      )
+    RETURNING o.*;
+END;
+$$;
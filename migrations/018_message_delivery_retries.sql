@@ -0,0 +1,27 @@
+-- ============================================================================
+-- Migration: Retry failed message sends through the scheduler, with a cap
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+ALTER TABLE cupido_messages
+ADD COLUMN IF NOT EXISTS delivery_attempts INT NOT NULL DEFAULT 0;
+
+-- Records one failed send for each listed undelivered message and re-queues it:
+-- due again after 2^(failures - 1) minutes (DB clock), which the scheduled_queued
+-- trigger (005) picks up. Immediate sends (scheduled_at NULL) enter the queue this
+-- way. After p_max_attempts failures scheduled_at is cleared, so the message
+-- leaves the due set for good. Returns the updated messages.
+CREATE OR REPLACE FUNCTION record_delivery_failures(p_ids UUID[], p_max_attempts INT)
+RETURNS SETOF cupido_messages
+LANGUAGE sql
+AS $$
+    UPDATE cupido_messages
+    SET delivery_attempts = delivery_attempts + 1,
+        scheduled_at = CASE
+            WHEN delivery_attempts + 1 >= p_max_attempts THEN NULL
+            ELSE NOW() + make_interval(mins => power(2, delivery_attempts)::INT)
+        END
+    WHERE id = ANY(p_ids)
+      AND delivered = FALSE
+    RETURNING *;
+$$;
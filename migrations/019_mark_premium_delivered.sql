@@ -0,0 +1,25 @@
+-- ============================================================================
+-- Migration: Close a premium order server-side once its link is sent
+-- Run this in Supabase SQL Editor
+-- ============================================================================
+
+-- Premium variant of mark_order_delivered (006): the presentation link is the
+-- delivery, so the order's message entry (created by submit_premium) is flagged
+-- delivered and the order closed with delivered_at on the DB clock, in one
+-- statement. Returns the updated order.
+CREATE OR REPLACE FUNCTION mark_premium_delivered(p_id UUID)
+RETURNS SETOF cupido_orders
+LANGUAGE sql
+AS $$
+    WITH messages AS (
+        UPDATE cupido_messages
+        SET delivered = TRUE
+        WHERE order_id = p_id
+          AND delivered = FALSE
+    )
+    UPDATE cupido_orders o
+    SET status = 'delivered',
+        delivered_at = NOW()
+    WHERE o.id = p_id
+    RETURNING o.*;
+$$;
@@ -1,103 +1,359 @@
 """
 Cupido API - Anonymous WhatsApp Messages Service
 """
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+from typing import Dict, Tuple
 
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 
 from src.config import settings
-from src.models import OrderStatus
+from src.services.cupido_service import cupido_service
+from src.services.elevenlabs_service import elevenlabs_service
+from src.services.pg_pool import pg_pool
+from src.services.redis_service import redis_service
 from src.services.supabase_service import supabase_service
+from src.services.uazapi_service import uazapi_service
+from src.utils.background import bind_loop
+from src.utils.body_limit import BodyLimitMiddleware
 from src.utils.logger import get_logger
+from src.utils.probes import ProbeMiddleware
+from src.utils.validators import parse_utc_datetime
 
 logger = get_logger(__name__)
 
-scheduler = AsyncIOScheduler()
+# Max orders delivered concurrently per scheduler tick (UAZAPI / DB pressure cap)
+SCHEDULED_DELIVERY_CONCURRENCY = 8
+
+# Postgres NOTIFY channel for due scheduled messages (migrations/004)
+SCHEDULED_DUE_CHANNEL = "scheduled_due"
+
+# Postgres NOTIFY channel for messages scheduled into the future (migrations/005)
+SCHEDULED_QUEUED_CHANNEL = "scheduled_queued"
+
+# Safety-net polling interval: long when NOTIFY pushes due messages, short otherwise
+POLL_MINUTES_WITH_LISTEN = 5
+POLL_MINUTES_WITHOUT_LISTEN = 1
+
+# Request body caps (webhook JSON is tiny; form submits carry text only, uploads are separate)
+WEBHOOK_MAX_BODY_BYTES = 64 * 1024
+FORM_SUBMIT_MAX_BODY_BYTES = 1024 * 1024
+
+_due_queue: asyncio.Queue = asyncio.Queue()
+_tick_lock = asyncio.Lock()
+
+# Upcoming scheduled messages as (scheduled_at, message_id), earliest first
+_upcoming: asyncio.PriorityQueue = asyncio.PriorityQueue()
+_upcoming_changed = asyncio.Event()
+
+# Messages already sent whose delivered flag could not be written yet, by id:
+# retried every tick and never re-sent while they wait here
+_unmarked: Dict[str, dict] = {}
+
+
+async def _deliver_scheduled_for_order(messages: list) -> Tuple[list, list]:
+    """Send one order's due messages in order; returns (delivery records to mark, failed ids)."""
+    deliveries = []
+    failed = []
+    for msg in messages:
+        try:
+            order_data = msg["cupido_orders"]
+
+            # Build order dict for send_single_message
+            order = {
+                "id": order_data["id"],
+                "plan": order_data["plan"],
+                "recipient_phone": order_data["recipient_phone"],
+                "buyer_phone": order_data.get("buyer_phone"),
+                "messages_sent": order_data.get("messages_sent", 0),
+                "status": order_data.get("status"),
+            }
+
+            delivery = await cupido_service.send_single_message(order, msg)
+
+            if delivery is not None:
+                logger.info(f"Scheduled message {msg['id']} delivered")
+                deliveries.append(delivery)
+            else:
+                logger.error(f"Failed to deliver scheduled message {msg['id']}")
+                failed.append(msg["id"])
+
+        except Exception as e:
+            logger.error(f"Error processing scheduled message {msg['id']}: {e}")
+            failed.append(msg["id"])
+
+    return deliveries, failed
 
 
 async def process_scheduled_messages():
     """Check for scheduled messages whose time has passed and deliver them."""
+    # NOTIFY-driven and polling ticks must never deliver the same batch twice
+    async with _tick_lock:
+        await _process_scheduled_messages()
+
+
+async def _process_scheduled_messages():
     try:
+        await _flush_unmarked()
         now_iso = datetime.now(timezone.utc).isoformat()
-        messages = supabase_service.get_pending_scheduled_messages(now_iso)
+        after = None
+        # Keyset pages: failed deliveries stay due but are not re-read this tick
+        while True:
+            messages = await supabase_service.get_pending_scheduled_messages(now_iso, after=after)
+            if not messages:
+                return
+            await _deliver_scheduled_page(messages)
+            if len(messages) < supabase_service.SCHEDULED_PAGE_SIZE:
+                return
+            after = (messages[-1]["scheduled_at"], messages[-1]["id"])
 
-        if not messages:
-            return
+    except Exception as e:
+        logger.error(f"Error in process_scheduled_messages: {e}")
 
-        logger.info(f"Processing {len(messages)} scheduled messages")
 
-        # Import here to avoid circular imports
-        from src.services.cupido_service import cupido_service
-        from src.plans import get_plan_config
-        from src.models import PlanType
+async def _flush_unmarked() -> None:
+    """Retry flagging messages that were sent but whose mark failed on an earlier tick."""
+    if not _unmarked:
+        return
+    pending = list(_unmarked.values())
+    if await asyncio.to_thread(supabase_service.mark_messages_delivered, pending) is None:
+        logger.error(f"{len(pending)} sent messages still not marked delivered")
+        return
+    for delivery in pending:
+        _unmarked.pop(delivery["id"], None)
+
+
+async def _mark_order_deliveries(deliveries: list, failed: list) -> None:
+    """
+    Write one order's outcome as soon as it is sent: flag the delivered messages,
+    closing the order when nothing is left pending (RPC mark_messages_delivered),
+    and re-queue the failed ones with backoff (dropped after MAX_DELIVERY_ATTEMPTS).
+    """
+    deliveries = [delivery for delivery in deliveries if delivery["id"]]
+    if await asyncio.to_thread(supabase_service.mark_messages_delivered, deliveries) is None:
+        # Still flagged undelivered in the DB: keep them here so the next tick
+        # retries the mark instead of sending them again
+        for delivery in deliveries:
+            _unmarked[delivery["id"]] = delivery
+    await asyncio.to_thread(supabase_service.record_delivery_failures, failed)
+
+
+async def _deliver_scheduled_page(messages: list) -> None:
+    logger.info(f"Processing {len(messages)} scheduled messages")
+
+    # Group by order: one order's messages go out sequentially (recipient sees
+    # them in order), different orders are delivered concurrently.
+    by_order: dict = {}
+    for msg in messages:
+        if msg["id"] in _unmarked:
+            continue
+        order_data = msg.get("cupido_orders")
+        if not order_data:
+            logger.warning(f"No order data for scheduled message {msg['id']}")
+            continue
+        by_order.setdefault(order_data["id"], []).append(msg)
+
+    semaphore = asyncio.Semaphore(SCHEDULED_DELIVERY_CONCURRENCY)
+
+    async def _bounded(order_messages: list) -> None:
+        async with semaphore:
+            deliveries, failed = await _deliver_scheduled_for_order(order_messages)
+            await _mark_order_deliveries(deliveries, failed)
+
+    await asyncio.gather(
+        *(_bounded(order_messages) for order_messages in by_order.values()),
+        return_exceptions=True,
+    )
+
+
+def _on_scheduled_due(connection, pid, channel, payload) -> None:
+    """asyncpg LISTEN callback: queue the due message id for the dispatcher."""
+    _due_queue.put_nowait(payload)
+
+
+async def _due_dispatcher() -> None:
+    """Run a delivery tick whenever Postgres reports due messages."""
+    while True:
+        await _due_queue.get()
+        # Coalesce bursts: a single tick delivers everything due so far
+        while not _due_queue.empty():
+            _due_queue.get_nowait()
+        await process_scheduled_messages()
+
+
+def _queue_upcoming(message_id: str, scheduled_at: str) -> None:
+    """Add a scheduled message to the in-process timer queue."""
+    try:
+        due_at = parse_utc_datetime(scheduled_at)
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid scheduled_at for message {message_id}: {scheduled_at}")
+        return
+    _upcoming.put_nowait((due_at, message_id))
+    _upcoming_changed.set()
 
-        for msg in messages:
-            try:
-                order_data = msg.get("cupido_orders")
-                if not order_data:
-                    logger.warning(f"No order data for scheduled message {msg['id']}")
-                    continue
-
-                # Build order dict for deliver_single_message
-                order = {
-                    "id": order_data["id"],
-                    "plan": order_data["plan"],
-                    "recipient_phone": order_data["recipient_phone"],
-                    "buyer_phone": order_data.get("buyer_phone"),
-                    "messages_sent": order_data.get("messages_sent", 0),
-                    "status": order_data.get("status"),
-                }
-
-                success = await cupido_service.deliver_single_message(order, msg)
-
-                if success:
-                    logger.info(f"Scheduled message {msg['id']} delivered")
-
-                    # Check if all messages for this order are now delivered
-                    plan_config = get_plan_config(PlanType(order["plan"]))
-                    messages_sent = order.get("messages_sent", 0) or 0
-
-                    # Count undelivered messages
-                    all_msgs = supabase_service.get_messages_by_order(order["id"])
-                    undelivered = [m for m in all_msgs if not m.get("delivered")]
-                    if not undelivered:
-                        supabase_service.update_order(order["id"], {
-                            "status": OrderStatus.DELIVERED.value,
-                            "delivered_at": "now()",
-                        })
-                        logger.info(f"Order {order['id']} fully delivered")
-                else:
-                    logger.error(f"Failed to deliver scheduled message {msg['id']}")
-
-            except Exception as e:
-                logger.error(f"Error processing scheduled message {msg['id']}: {e}")
 
+def _on_scheduled_queued(connection, pid, channel, payload) -> None:
+    """asyncpg LISTEN callback: a message was scheduled into the future."""
+    try:
+        data = json.loads(payload)
+        _queue_upcoming(data["id"], data["scheduled_at"])
     except Exception as e:
-        logger.error(f"Error in process_scheduled_messages: {e}")
+        logger.warning(f"Invalid {channel} payload {payload!r}: {e}")
+
+
+async def _upcoming_timer() -> None:
+    """Sleep until the earliest upcoming message is due, then hand it to the dispatcher."""
+    while True:
+        due_at, message_id = await _upcoming.get()
+        delay = (due_at - datetime.now(timezone.utc)).total_seconds()
+        if delay > 0:
+            # Not due yet: put it back and wait, waking early if a sooner one arrives
+            _upcoming.put_nowait((due_at, message_id))
+            _upcoming_changed.clear()
+            try:
+                await asyncio.wait_for(_upcoming_changed.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        _due_queue.put_nowait(message_id)
+
+
+def _poll_seconds() -> float:
+    minutes = POLL_MINUTES_WITH_LISTEN if pg_pool.listening else POLL_MINUTES_WITHOUT_LISTEN
+    return minutes * 60
+
+
+async def _poll_loop() -> None:
+    """
+    Run process_scheduled_messages periodically on the monotonic clock. The interval
+    follows the LISTEN connection: re-evaluated as soon as it drops or comes back.
+    """
+    while True:
+        started = time.monotonic()
+        pg_pool.listen_state_changed.clear()
+        await process_scheduled_messages()
+        while True:
+            remaining = started + _poll_seconds() - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(pg_pool.listen_state_changed.wait(), timeout=remaining)
+                pg_pool.listen_state_changed.clear()
+            except asyncio.TimeoutError:
+                break
+
+
+HEALTH_RESPONSE = {"status": "ok", "service": "cupido"}
+LIVE_RESPONSE = {"status": "alive"}
+
+
+def _include_routes(app: FastAPI) -> None:
+    """
+    Import and register page/API routers. Done at startup rather than import
+    time so importing src.api stays cheap (templates, fidelidade deps, ...).
+    """
+    if getattr(app.state, "routes_included", False):
+        return
+
+    from src.routes.quiz import router as quiz_router
+    from src.routes.webhook import router as webhook_router
+    from src.routes.form import router as form_router
+    from src.routes.presentation import router as presentation_router
+    from src.routes.fidelidade import router as fidelidade_router
+    from src.routes.acesso import router as acesso_router
+
+    app.include_router(quiz_router)
+    app.include_router(webhook_router)
+    app.include_router(form_router)
+    app.include_router(presentation_router)
+    app.include_router(fidelidade_router)
+    app.include_router(acesso_router)
+
+    # Static files (mount after routes so routes take priority)
+    app.mount("/static", StaticFiles(directory="src/static"), name="static")
+
+    app.state.routes_included = True
+
+
+async def _warm_http_clients() -> None:
+    """Pre-open keep-alive connections so the first delivery skips the TLS handshake."""
+    await asyncio.gather(uazapi_service.warm(), elevenlabs_service.warm())
+
+
+async def _view_count_flusher() -> None:
+    """Write buffered presentation views periodically."""
+    while True:
+        await asyncio.sleep(supabase_service.VIEW_COUNT_FLUSH_SECONDS)
+        await supabase_service.flush_view_counts()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events."""
     logger.info("Starting Cupido API...")
+    loop = asyncio.get_running_loop()
+    bind_loop(loop)
+    # Bounded pool for asyncio.to_thread (sync Supabase calls), sized to the DB budget
+    loop.set_default_executor(
+        ThreadPoolExecutor(max_workers=settings.SUPABASE_THREADS, thread_name_prefix="supabase")
+    )
+
+    _include_routes(app)
 
-    # Connect Supabase
+    # Connect Supabase (+ optional direct Postgres pool for hot reads)
     supabase_service.connect()
+    await pg_pool.connect()
+
+    # Optional cache
+    await redis_service.connect()
+
+    # Background WhatsApp senders (bounded fire-and-forget texts)
+    uazapi_service.start_outbox()
+
+    # Push: deliver as soon as Postgres NOTIFYs due messages (session-mode LISTEN URL only;
+    # a lost connection is re-established by pg_pool in the background)
+    background = []
+    if pg_pool.listen_configured:
+        await pg_pool.listen(SCHEDULED_DUE_CHANNEL, _on_scheduled_due)
+        background.append(asyncio.create_task(_due_dispatcher()))
 
-    # Start scheduler for scheduled messages
-    scheduler.add_job(process_scheduled_messages, "interval", minutes=1)
-    scheduler.start()
-    logger.info("Scheduler started (checking every 1 minute)")
+        # Timer queue: deliver each message at its scheduled_at, not on the next tick
+        await pg_pool.listen(SCHEDULED_QUEUED_CHANNEL, _on_scheduled_queued)
+        for msg in await supabase_service.get_upcoming_scheduled_messages():
+            _queue_upcoming(msg["id"], msg["scheduled_at"])
+        background.append(asyncio.create_task(_upcoming_timer()))
+
+    # Poll: safety net for missed notifications (or the only path without LISTEN);
+    # every POLL_MINUTES_WITHOUT_LISTEN while the LISTEN connection is down
+    background.append(asyncio.create_task(_poll_loop()))
+    logger.info(f"Scheduler started (checking every {_poll_seconds() / 60:.0f} minute(s))")
+
+    # Presentation views are buffered and written in batches
+    background.append(asyncio.create_task(_view_count_flusher()))
+
+    # Warm the UAZAPI / ElevenLabs connections off the startup path
+    background.append(asyncio.create_task(_warm_http_clients()))
 
     logger.info("Cupido API ready!")
     yield
 
-    scheduler.shutdown()
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await uazapi_service.stop_outbox()
+    await uazapi_service.aclose()
+    await elevenlabs_service.aclose()
+    await supabase_service.flush_view_counts()
+    await pg_pool.close()
+    await redis_service.close()
     logger.info("Cupido API stopped.")
 
 
@@ -106,62 +362,51 @@ app = FastAPI(
     description="Anonymous WhatsApp messages service",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
-# CORS
+# CORS (wildcard without credentials, so Starlette doesn't echo each Origin back)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.ALLOWED_ORIGINS.split(","),
-    allow_credentials=True,
+    allow_origins=settings.allowed_origins,
+    allow_credentials=not settings.allow_any_origin,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# Routes
-from src.routes.quiz import router as quiz_router
-from src.routes.webhook import router as webhook_router
-from src.routes.form import router as form_router
-from src.routes.presentation import router as presentation_router
-from src.routes.fidelidade import router as fidelidade_router
-from src.routes.acesso import router as acesso_router
+# Compress rendered templates / static text (small JSON bodies pass through)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
-app.include_router(quiz_router)
-app.include_router(webhook_router)
-app.include_router(form_router)
-app.include_router(presentation_router)
-app.include_router(fidelidade_router)
-app.include_router(acesso_router)
+# Reject oversize webhook / form submit bodies before they are buffered and parsed
+app.add_middleware(BodyLimitMiddleware, rules=[
+    ("/webhook/", "", WEBHOOK_MAX_BODY_BYTES),
+    ("/form/", "/submit", FORM_SUBMIT_MAX_BODY_BYTES),
+])
 
-# Static files (mount after routes so routes take priority)
-app.mount("/static", StaticFiles(directory="src/static"), name="static")
+# Probes (added last = outermost): answered before CORS/GZip and routing
+app.add_middleware(ProbeMiddleware, responses={"/health": HEALTH_RESPONSE, "/live": LIVE_RESPONSE})
 
 
 # ── Health checks ────────────────────────────────────────────────────
 
+# /health and /live are served by ProbeMiddleware; the routes document them
 @app.get("/health")
 async def health():
-    return {"status": "ok", "service": "cupido"}
+    return HEALTH_RESPONSE
 
 
 @app.get("/live")
 async def liveness():
-    return {"status": "alive"}
+    return LIVE_RESPONSE
 
 
 @app.get("/ready")
 async def readiness():
-    checks = {"supabase": False}
-
-    try:
-        if supabase_service.client:
-            checks["supabase"] = True
-    except Exception:
-        pass
-
-    all_ok = checks["supabase"]
+    all_ok = supabase_service.ready
+    checks = {"supabase": all_ok}
     status_code = 200 if all_ok else 503
 
-    return JSONResponse(
+    return ORJSONResponse(
         content={"status": "ready" if all_ok else "not_ready", "checks": checks},
         status_code=status_code,
     )
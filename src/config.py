@@ -2,8 +2,9 @@
 Configuration Management
 Centralized settings for Cupido - Anonymous WhatsApp Messages
 """
-from typing import Optional
+from typing import Optional, Tuple
 
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
 
 
@@ -18,6 +19,17 @@ class Settings(BaseSettings):
     SUPABASE_URL: str
     SUPABASE_KEY: str
     SUPABASE_SERVICE_KEY: Optional[str] = None
+    # Worker threads for the sync supabase-py client (asyncio default executor)
+    SUPABASE_THREADS: int = 16
+
+    # Postgres direct (optional, hot reads via asyncpg over Supavisor)
+    SUPABASE_DB_URL: Optional[str] = None
+    PG_POOL_MIN_SIZE: int = 5
+    PG_POOL_MAX_SIZE: int = 20
+    # LISTEN/NOTIFY push for scheduled messages: needs a session-mode connection (pooler
+    # port 5432 or direct). Transaction mode (6543) never delivers NOTIFY, so there is no
+    # fallback to SUPABASE_DB_URL; unset means polling only
+    SUPABASE_DB_LISTEN_URL: Optional[str] = None
 
     # UAZAPI (WhatsApp)
     UAZAPI_BASE_URL: str = "https://n8nvortexx.uazapi.com"
@@ -40,6 +52,15 @@ class Settings(BaseSettings):
     FIDELIDADE_UAZAPI_TOKEN: str = ""
     FIDELIDADE_CHECKOUT_URL: str = ""
     FIDELIDADE_JWT_SECRET: str = ""
+    # bcrypt work factor for new/upgraded password hashes (library default is 12);
+    # existing hashes are only ever re-hashed upwards
+    BCRYPT_COST: int = 12
+
+    # Logging: one JSON object per line on stdout instead of the colored format
+    LOG_JSON: bool = False
+
+    # Redis (optional cache)
+    REDIS_URL: Optional[str] = None
 
     # CORS
     ALLOWED_ORIGINS: str = "*"
@@ -48,6 +69,21 @@ class Settings(BaseSettings):
         env_file = ".env"
         case_sensitive = True
 
+    @field_validator("APP_BASE_URL")
+    @classmethod
+    def _normalize_base_url(cls, value: str) -> str:
+        """Strip whitespace and trailing slashes once, so URLs can be built by plain concatenation."""
+        return value.strip().rstrip("/")
+
+    @property
+    def allowed_origins(self) -> Tuple[str, ...]:
+        """ALLOWED_ORIGINS parsed from its comma-separated form."""
+        return tuple(o.strip() for o in self.ALLOWED_ORIGINS.split(",") if o.strip())
+
+    @property
+    def allow_any_origin(self) -> bool:
+        return self.allowed_origins == ("*",)
+
 
 # Global settings instance
 settings = Settings()
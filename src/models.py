@@ -2,7 +2,7 @@
 Data models for Cupido
 """
 from enum import Enum
-from typing import List, Optional
+from typing import List, Optional, TypedDict
 
 from pydantic import BaseModel, Field
 
@@ -25,6 +25,40 @@ class OrderStatus(str, Enum):
     CANCELED = "canceled"
 
 
+# ── Database Rows ──────────────────────────────────────────────────────
+# Shapes of the dicts the Supabase client / asyncpg return (typing only, no
+# runtime conversion: rows stay plain dicts on the hot path)
+
+class OrderRow(TypedDict, total=False):
+    id: str
+    sale_id: Optional[str]
+    plan: str
+    status: str
+    buyer_name: Optional[str]
+    buyer_phone: str
+    buyer_email: Optional[str]
+    product_name: Optional[str]
+    recipient_phone: Optional[str]
+    form_token: str
+    is_test: bool
+    messages_sent: int
+    created_at: str
+    delivered_at: Optional[str]
+
+
+class MessageRow(TypedDict, total=False):
+    id: str
+    order_id: str
+    message_index: int
+    content: str
+    audio_url: Optional[str]
+    audio_text: Optional[str]
+    sender_nickname: Optional[str]
+    scheduled_at: Optional[str]
+    delivered: bool
+    created_at: str
+
+
 # ── Lowify Webhook ─────────────────────────────────────────────────────
 
 class LowifyCustomer(BaseModel):
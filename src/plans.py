@@ -2,13 +2,16 @@
 Plan configuration for Cupido
 Maps Lowify products to plan types and defines plan capabilities.
 """
+import re
 from dataclasses import dataclass
-from typing import Optional
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping, Optional
 
 from src.models import PlanType
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class PlanConfig:
     plan_type: PlanType
     max_messages: int
@@ -20,7 +23,7 @@ class PlanConfig:
     audio_char_limit: int = 0
 
 
-PLANS: dict[PlanType, PlanConfig] = {
+PLANS: Mapping[PlanType, PlanConfig] = MappingProxyType({
     PlanType.BASICO: PlanConfig(
         plan_type=PlanType.BASICO,
         max_messages=1,
@@ -60,11 +63,11 @@ PLANS: dict[PlanType, PlanConfig] = {
         price=25,
         audio_char_limit=300,
     ),
-}
+})
 
 # Mapeamento Lowify product_id -> PlanType
 # Atualizar com os IDs reais dos produtos na Lowify
-PRODUCT_ID_MAP: dict[str, PlanType] = {
+PRODUCT_ID_MAP: Mapping[str, PlanType] = MappingProxyType({
     # Lowify checkout slugs
     "OaU4np": PlanType.BASICO,
     "040pTc": PlanType.COM_AUDIO,
@@ -72,10 +75,10 @@ PRODUCT_ID_MAP: dict[str, PlanType] = {
     "5GRqwI": PlanType.PREMIUM_HISTORIA,
     # Lowify numeric IDs
     "22018": PlanType.BASICO,
-}
+})
 
 # Mapeamento por nome do produto (fallback)
-PRODUCT_NAME_MAP: dict[str, PlanType] = {
+PRODUCT_NAME_MAP: Mapping[str, PlanType] = MappingProxyType({
     "cupido basico": PlanType.BASICO,
     "cupido com audio": PlanType.COM_AUDIO,
     "cupido audio": PlanType.COM_AUDIO,
@@ -89,19 +92,31 @@ PRODUCT_NAME_MAP: dict[str, PlanType] = {
     "stitch 5 mensagens": PlanType.MULTI_MENSAGEM,
     "stitch apresenta": PlanType.PREMIUM_HISTORIA,
     "stitch premium": PlanType.PREMIUM_HISTORIA,
-}
+})
 
 
+# All name keywords in one precompiled pattern: a single C-level scan per name.
+# The lookahead reports overlapping matches too, and the keyword priority keeps
+# PRODUCT_NAME_MAP order semantics (first keyword in the map wins).
+_KEYWORD_PRIORITY: dict[str, int] = {keyword: i for i, keyword in enumerate(PRODUCT_NAME_MAP)}
+_PRODUCT_NAME_RE = re.compile(
+    "(?=(" + "|".join(re.escape(keyword) for keyword in PRODUCT_NAME_MAP) + "))"
+)
+
+
+@lru_cache(maxsize=256)
 def resolve_plan(product_id: Optional[str] = None, product_name: Optional[str] = None) -> PlanType:
     """Determine plan type from Lowify product info."""
-    if product_id and product_id in PRODUCT_ID_MAP:
-        return PRODUCT_ID_MAP[product_id]
+    if product_id:
+        plan = PRODUCT_ID_MAP.get(product_id)
+        if plan:
+            return plan
 
     if product_name:
         name_lower = product_name.lower().strip()
-        for keyword, plan in PRODUCT_NAME_MAP.items():
-            if keyword in name_lower:
-                return plan
+        keywords = [match.group(1) for match in _PRODUCT_NAME_RE.finditer(name_lower)]
+        if keywords:
+            return PRODUCT_NAME_MAP[min(keywords, key=_KEYWORD_PRIORITY.__getitem__)]
 
     # Default: basico
     return PlanType.BASICO
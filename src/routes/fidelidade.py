@@ -1,20 +1,21 @@
 """
 Fidelidade routes - Teste de Fidelidade pages and API
 """
+import asyncio
 from typing import Optional
 
 from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, ORJSONResponse
+from pydantic import BaseModel, field_validator
 
 from src.config import settings
 from src.services.fidelidade_service import fidelidade_service
 from src.utils.logger import get_logger
+from src.utils.templating import templates
+from src.utils.validators import normalize_email
 
 logger = get_logger(__name__)
 router = APIRouter(tags=["fidelidade"])
-templates = Jinja2Templates(directory="src/templates")
 
 
 # ── Pydantic models ────────────────────────────────────────────
@@ -25,11 +26,15 @@ class RegisterPayload(BaseModel):
     telefone: str
     senha: str
 
+    _normalize_email = field_validator("email")(normalize_email)
+
 
 class LoginPayload(BaseModel):
     email: str
     senha: str
 
+    _normalize_email = field_validator("email")(normalize_email)
+
 
 class CreateTestPayload(BaseModel):
     target_phone: str
@@ -113,55 +118,57 @@ async def fidelidade_chat_page(request: Request, test_id: str):
 async def api_register(payload: RegisterPayload):
     """Register a new user."""
     if not payload.nome or not payload.email or not payload.telefone or not payload.senha:
-        return JSONResponse({"success": False, "error": "Preencha todos os campos"}, status_code=400)
+        return ORJSONResponse({"success": False, "error": "Preencha todos os campos"}, status_code=400)
 
     if len(payload.senha) < 6:
-        return JSONResponse({"success": False, "error": "Senha deve ter no minimo 6 caracteres"}, status_code=400)
+        return ORJSONResponse({"success": False, "error": "Senha deve ter no minimo 6 caracteres"}, status_code=400)
 
-    result = fidelidade_service.register_user(
-        payload.nome, payload.email, payload.telefone, payload.senha
+    # bcrypt hashing is CPU-bound - keep it off the event loop
+    result = await asyncio.to_thread(
+        fidelidade_service.register_user,
+        payload.nome, payload.email, payload.telefone, payload.senha,
     )
 
     status = 200 if result["success"] else 400
-    return JSONResponse(result, status_code=status)
+    return ORJSONResponse(result, status_code=status)
 
 
 @router.post("/api/fidelidade/login")
 async def api_login(payload: LoginPayload):
     """Login user."""
     if not payload.email or not payload.senha:
-        return JSONResponse({"success": False, "error": "Preencha todos os campos"}, status_code=400)
+        return ORJSONResponse({"success": False, "error": "Preencha todos os campos"}, status_code=400)
 
-    result = fidelidade_service.login_user(payload.email, payload.senha)
+    result = await asyncio.to_thread(fidelidade_service.login_user, payload.email, payload.senha)
     status = 200 if result["success"] else 401
-    return JSONResponse(result, status_code=status)
+    return ORJSONResponse(result, status_code=status)
 
 
 @router.post("/api/fidelidade/access-by-phone")
 async def api_access_by_phone(payload: AccessByPhonePayload):
     """Look up user by phone, return JWT token + most recent test_id."""
     if not payload.phone:
-        return JSONResponse({"success": False, "error": "Digite seu WhatsApp"}, status_code=400)
+        return ORJSONResponse({"success": False, "error": "Digite seu WhatsApp"}, status_code=400)
 
-    result = fidelidade_service.access_by_phone(payload.phone)
+    result = await asyncio.to_thread(fidelidade_service.access_by_phone, payload.phone)
     status = 200 if result["success"] else 404
-    return JSONResponse(result, status_code=status)
+    return ORJSONResponse(result, status_code=status)
 
 
 @router.post("/api/fidelidade/quick-test")
 async def api_quick_test(payload: QuickTestPayload):
     """Create test directly from quiz (no separate registration)."""
     if not payload.nome or not payload.buyer_phone or not payload.target_phone or not payload.first_message:
-        return JSONResponse({"success": False, "error": "Preencha todos os campos"}, status_code=400)
+        return ORJSONResponse({"success": False, "error": "Preencha todos os campos"}, status_code=400)
 
     if len(payload.first_message) > 500:
-        return JSONResponse({"success": False, "error": "Mensagem muito longa (max 500)"}, status_code=400)
+        return ORJSONResponse({"success": False, "error": "Mensagem muito longa (max 500)"}, status_code=400)
 
     result = await fidelidade_service.quick_create_test(
         payload.nome, payload.buyer_phone, payload.target_phone, payload.first_message
     )
     status = 200 if result["success"] else 400
-    return JSONResponse(result, status_code=status)
+    return ORJSONResponse(result, status_code=status)
 
 
 @router.post("/api/fidelidade/test")
@@ -169,14 +176,14 @@ async def api_create_test(request: Request, payload: CreateTestPayload):
     """Create a new fidelidade test."""
     user_id = get_user_id_from_request(request)
     if not user_id:
-        return JSONResponse({"success": False, "error": "Nao autorizado"}, status_code=401)
+        return ORJSONResponse({"success": False, "error": "Nao autorizado"}, status_code=401)
 
     if not payload.target_phone or not payload.first_message:
-        return JSONResponse({"success": False, "error": "Preencha todos os campos"}, status_code=400)
+        return ORJSONResponse({"success": False, "error": "Preencha todos os campos"}, status_code=400)
 
     result = await fidelidade_service.create_test(user_id, payload.target_phone, payload.first_message)
     status = 200 if result["success"] else 400
-    return JSONResponse(result, status_code=status)
+    return ORJSONResponse(result, status_code=status)
 
 
 @router.get("/api/fidelidade/tests")
@@ -184,10 +191,10 @@ async def api_list_tests(request: Request):
     """List all tests for the logged-in user."""
     user_id = get_user_id_from_request(request)
     if not user_id:
-        return JSONResponse({"success": False, "error": "Nao autorizado"}, status_code=401)
+        return ORJSONResponse({"success": False, "error": "Nao autorizado"}, status_code=401)
 
-    tests = fidelidade_service.get_user_tests(user_id)
-    return JSONResponse({"success": True, "tests": tests})
+    tests = await asyncio.to_thread(fidelidade_service.get_user_tests, user_id)
+    return ORJSONResponse({"success": True, "tests": tests})
 
 
 @router.get("/api/fidelidade/messages/{test_id}")
@@ -195,11 +202,11 @@ async def api_get_messages(request: Request, test_id: str):
     """Get messages for a test."""
     user_id = get_user_id_from_request(request)
     if not user_id:
-        return JSONResponse({"success": False, "error": "Nao autorizado"}, status_code=401)
+        return ORJSONResponse({"success": False, "error": "Nao autorizado"}, status_code=401)
 
-    result = fidelidade_service.get_messages(test_id, user_id)
+    result = await asyncio.to_thread(fidelidade_service.get_messages, test_id, user_id)
     status = 200 if result["success"] else 403
-    return JSONResponse(result, status_code=status)
+    return ORJSONResponse(result, status_code=status)
 
 
 @router.post("/api/fidelidade/messages/{test_id}")
@@ -207,11 +214,11 @@ async def api_send_message(request: Request, test_id: str, payload: SendMessageP
     """Send a message in an active test."""
     user_id = get_user_id_from_request(request)
     if not user_id:
-        return JSONResponse({"success": False, "error": "Nao autorizado"}, status_code=401)
+        return ORJSONResponse({"success": False, "error": "Nao autorizado"}, status_code=401)
 
     if not payload.content:
-        return JSONResponse({"success": False, "error": "Mensagem vazia"}, status_code=400)
+        return ORJSONResponse({"success": False, "error": "Mensagem vazia"}, status_code=400)
 
     result = await fidelidade_service.send_message(test_id, user_id, payload.content)
     status = 200 if result["success"] else 400
-    return JSONResponse(result, status_code=status)
+    return ORJSONResponse(result, status_code=status)
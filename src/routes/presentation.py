@@ -1,22 +1,24 @@
 """
 Presentation routes - Slideshow viewer for premium plan
 """
+import asyncio
+
+import orjson
 from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 
 from src.services.supabase_service import supabase_service
 from src.utils.logger import get_logger
+from src.utils.templating import templates
 
 logger = get_logger(__name__)
 router = APIRouter(tags=["presentation"])
-templates = Jinja2Templates(directory="src/templates")
 
 
 @router.get("/p/{presentation_id}", response_class=HTMLResponse)
 async def view_presentation(request: Request, presentation_id: str):
     """Render the fullscreen slideshow presentation."""
-    presentation = supabase_service.get_presentation(presentation_id)
+    presentation = await asyncio.to_thread(supabase_service.get_presentation, presentation_id)
 
     if not presentation:
         return templates.TemplateResponse("error.html", {
@@ -25,13 +27,13 @@ async def view_presentation(request: Request, presentation_id: str):
             "message": "Este link nao existe ou expirou.",
         })
 
-    # Increment view count
+    # Increment view count (buffered, written in batches)
     supabase_service.increment_view_count(presentation_id)
 
     slides = presentation.get("slides", [])
     if isinstance(slides, str):
-        import json
-        slides = json.loads(slides)
+        # Legacy rows stored as a JSON string (normalized by migrations/008)
+        slides = orjson.loads(slides)
 
     return templates.TemplateResponse("presentation.html", {
         "request": request,
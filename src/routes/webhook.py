@@ -1,45 +1,54 @@
 """
 Webhook routes - Receives Lowify payment webhooks
 """
-import json
+import asyncio
+import re
 from typing import Any, Dict
 
+import orjson
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 
 from src.services.cupido_service import cupido_service
 from src.services.fidelidade_service import fidelidade_service
 from src.utils.fancy_logger import log_error, log_lowify_webhook
 from src.utils.logger import get_logger
+from src.utils.validators import normalize_email, strip_jid_suffix
 
 logger = get_logger(__name__)
 router = APIRouter(prefix="/webhook", tags=["webhook"])
 
+# Approved/paid events (substring match, so "sale.approved", "sale.completed",
+# "order.paid", ... all count). One precompiled scan instead of a Python loop.
+_APPROVED_EVENT_RE = re.compile("approved|completed|paid")
+
+# /lowify-debug logs the raw payload in the message text, cut at this many bytes
+DEBUG_PAYLOAD_LOG_BYTES = 8 * 1024
+
+
+def _is_approved_event(event: str) -> bool:
+    return bool(event) and _APPROVED_EVENT_RE.search(event.lower()) is not None
+
+
+# Shared read-only fallback for missing nested objects in UAZAPI payloads
+_EMPTY: Dict[str, Any] = {}
+
 
 @router.post("/lowify")
 async def webhook_lowify(request: Request):
     """Receive Lowify payment webhook and create order."""
     try:
-        payload = await request.json()
+        payload = orjson.loads(await request.body())
         log_lowify_webhook(payload)
 
         event = payload.get("event", "")
 
         # Only process approved/paid events
-        approved_events = [
-            "sale.approved",
-            "sale.completed",
-            "approved",
-            "completed",
-            "paid",
-        ]
-
-        event_lower = event.lower() if event else ""
-        is_approved = any(e in event_lower for e in approved_events)
+        is_approved = _is_approved_event(event)
 
         if not is_approved:
             logger.info(f"Ignoring event: {event}")
-            return JSONResponse(
+            return ORJSONResponse(
                 content={"status": "ignored", "event": event},
                 status_code=200,
             )
@@ -47,7 +56,7 @@ async def webhook_lowify(request: Request):
         order = await cupido_service.create_order_from_webhook(payload)
 
         if order:
-            return JSONResponse(
+            return ORJSONResponse(
                 content={
                     "status": "ok",
                     "order_id": order["id"],
@@ -56,14 +65,14 @@ async def webhook_lowify(request: Request):
                 status_code=200,
             )
 
-        return JSONResponse(
+        return ORJSONResponse(
             content={"status": "error", "message": "Failed to create order"},
             status_code=500,
         )
 
     except Exception as e:
         log_error("webhook_lowify", e)
-        return JSONResponse(
+        return ORJSONResponse(
             content={"status": "error", "message": str(e)},
             status_code=500,
         )
@@ -73,16 +82,22 @@ async def webhook_lowify(request: Request):
 async def webhook_lowify_debug(request: Request):
     """Debug endpoint - logs full payload without processing."""
     try:
-        payload = await request.json()
+        body = await request.body()
+        payload = orjson.loads(body)
         log_lowify_webhook(payload)
-        return JSONResponse(
+        # The structured line only carries the payload in its extras (JSON sink)
+        logger.info(
+            f"Debug webhook payload ({len(body)} bytes): "
+            f"{body[:DEBUG_PAYLOAD_LOG_BYTES].decode('utf-8', errors='replace')}"
+        )
+        return ORJSONResponse(
             content={"status": "ok", "payload_received": True},
             status_code=200,
         )
     except Exception as e:
         body = await request.body()
         logger.error(f"Debug webhook error: {e}, body: {body.decode()[:500]}")
-        return JSONResponse(
+        return ORJSONResponse(
             content={"status": "error", "message": str(e)},
             status_code=400,
         )
@@ -94,21 +109,19 @@ async def webhook_lowify_debug(request: Request):
 async def webhook_fidelidade(request: Request):
     """Receive Lowify payment webhook for Teste de Fidelidade."""
     try:
-        payload = await request.json()
+        payload = orjson.loads(await request.body())
         log_lowify_webhook(payload)
 
         event = payload.get("event", "")
-        approved_events = ["sale.approved", "sale.completed", "approved", "completed", "paid"]
-        event_lower = event.lower() if event else ""
-        is_approved = any(e in event_lower for e in approved_events)
+        is_approved = _is_approved_event(event)
 
         if not is_approved:
             logger.info(f"Fidelidade webhook: ignoring event: {event}")
-            return JSONResponse({"status": "ignored", "event": event}, status_code=200)
+            return ORJSONResponse({"status": "ignored", "event": event}, status_code=200)
 
         # Extract buyer info
         customer = payload.get("customer", {}) or {}
-        email = customer.get("email") or payload.get("customer_email", "")
+        email = normalize_email(customer.get("email") or payload.get("customer_email") or "")
         phone = customer.get("phone") or customer.get("telefone") or payload.get("customer_phone", "")
         sale_id = payload.get("sale_id", "")
 
@@ -116,39 +129,40 @@ async def webhook_fidelidade(request: Request):
 
         # Tenta ativar por email primeiro
         if email:
-            result = fidelidade_service.activate_test_by_email(email, sale_id)
+            result = await asyncio.to_thread(fidelidade_service.activate_test_by_email, email, sale_id)
 
         # Fallback: tenta por telefone (quiz cria email sintetico que nao bate com Lowify)
         if (not result or not result.get("success")) and phone:
             logger.info(f"Fidelidade webhook: email fallback failed, trying phone {phone[:7]}...")
-            result = fidelidade_service.activate_test_by_phone(phone, sale_id)
+            result = await asyncio.to_thread(fidelidade_service.activate_test_by_phone, phone, sale_id)
 
         if not result:
             logger.warning("Fidelidade webhook: no email or phone in payload")
-            return JSONResponse({"status": "error", "message": "No email or phone"}, status_code=400)
+            return ORJSONResponse({"status": "error", "message": "No email or phone"}, status_code=400)
 
         if result["success"]:
-            return JSONResponse({
+            return ORJSONResponse({
                 "status": "ok",
                 "test_id": result["test_id"],
             }, status_code=200)
 
-        return JSONResponse({
+        return ORJSONResponse({
             "status": "error",
             "message": result.get("error", "Failed"),
         }, status_code=400)
 
     except Exception as e:
         log_error("webhook_fidelidade", e)
-        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+        return ORJSONResponse({"status": "error", "message": str(e)}, status_code=500)
 
 
 @router.post("/uazapi")
 async def webhook_uazapi(request: Request):
     """Receive UAZAPI webhook when target replies to the 'woman' number."""
     try:
-        payload = await request.json()
-        logger.info(f"UAZAPI webhook received: {json.dumps(payload, ensure_ascii=False)[:500]}")
+        body = await request.body()
+        payload = orjson.loads(body)
+        logger.info(f"UAZAPI webhook received: {body[:500].decode(errors='replace')}")
 
         # UAZAPI sends message data - extract sender and content
         # Common UAZAPI payload structure:
@@ -156,41 +170,43 @@ async def webhook_uazapi(request: Request):
         data = payload.get("data", payload)
 
         # Try to extract from nested structure
-        key = data.get("key", {})
+        key = data.get("key") or _EMPTY
         remote_jid = key.get("remoteJid", "")
         from_me = key.get("fromMe", False)
 
         # Ignore messages sent by us
         if from_me:
-            return JSONResponse({"status": "ignored", "reason": "fromMe"}, status_code=200)
+            return ORJSONResponse({"status": "ignored", "reason": "fromMe"}, status_code=200)
 
         # Extract phone from remoteJid
-        sender_phone = remote_jid.replace("@s.whatsapp.net", "").replace("@c.us", "")
+        sender_phone = strip_jid_suffix(remote_jid)
 
         if not sender_phone:
             # Try alternative payload format
             sender_phone = data.get("phone", data.get("from", ""))
 
         if not sender_phone:
-            return JSONResponse({"status": "ignored", "reason": "no_phone"}, status_code=200)
+            return ORJSONResponse({"status": "ignored", "reason": "no_phone"}, status_code=200)
 
         # Extract message content
-        message_obj = data.get("message", {})
+        message_obj = data.get("message") or _EMPTY
+        extended = message_obj.get("extendedTextMessage") or _EMPTY
         content = (
             message_obj.get("conversation")
-            or message_obj.get("extendedTextMessage", {}).get("text")
-            or data.get("text", data.get("body", ""))
+            or extended.get("text")
+            or data.get("text")
+            or data.get("body")
         )
 
         if not content:
-            return JSONResponse({"status": "ignored", "reason": "no_content"}, status_code=200)
+            return ORJSONResponse({"status": "ignored", "reason": "no_content"}, status_code=200)
 
         result = await fidelidade_service.handle_inbound_message(sender_phone, content)
 
-        return JSONResponse({
+        return ORJSONResponse({
             "status": "ok" if result["success"] else "no_match",
         }, status_code=200)
 
     except Exception as e:
         log_error("webhook_uazapi", e)
-        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+        return ORJSONResponse({"status": "error", "message": str(e)}, status_code=500)
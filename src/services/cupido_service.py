@@ -1,14 +1,17 @@
 """
 Cupido Service - Core business logic for anonymous message delivery
 """
+import asyncio
+import re
 from typing import Any, Dict, Optional
 
 from src.config import settings
-from src.models import OrderStatus, PlanType
+from src.models import MessageRow, OrderRow, OrderStatus, PlanType
 from src.plans import get_plan_config, resolve_plan
 from src.services.elevenlabs_service import elevenlabs_service
 from src.services.supabase_service import supabase_service
 from src.services.uazapi_service import uazapi_service
+from src.utils.background import spawn
 from src.utils.fancy_logger import (
     log_audio_generated,
     log_error,
@@ -21,11 +24,37 @@ from src.utils.validators import clean_phone_for_whatsapp
 
 logger = get_logger(__name__)
 
+# Test events contain "test" in any case ("sale.test", "TEST_PURCHASE", ...);
+# matched without building a lowercased copy of the event
+_TEST_EVENT_RE = re.compile("test", re.IGNORECASE)
+
+# Recipient-facing WhatsApp texts, built once; calls only fill in the fields
+_MULTI_MESSAGE = (
+    "💘 *Mensagem Anonima do Cupido* ({n}/{total})\n\n"
+    "_{body}_\n\n"
+    "— {who}"
+).format
+
+_SINGLE_MESSAGE = (
+    "💘 *Mensagem Anonima do Cupido*\n\n"
+    "Alguem especial te enviou uma mensagem{with_audio}:\n\n"
+    "_{body}_\n\n"
+    "— {who}"
+).format
+
+_PREMIUM_MESSAGE = (
+    "💘 *Mensagem Anonima do Cupido*\n\n"
+    "Alguem especial preparou algo muito especial pra voce!\n\n"
+    "Abra o link abaixo para ver:\n\n"
+    "👉 {url}\n\n"
+    "💌 Feito com amor!"
+).format
+
 
 class CupidoService:
     """Core service for Cupido anonymous messages."""
 
-    async def create_order_from_webhook(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    async def create_order_from_webhook(self, payload: Dict[str, Any]) -> Optional[OrderRow]:
         """
         Create order from Lowify webhook and send form link to buyer.
         Returns the created order or None.
@@ -46,21 +75,20 @@ class CupidoService:
             logger.warning("Webhook without buyer phone - skipping")
             return None
 
-        # Check if order already exists for this sale
-        if sale_id:
-            existing = supabase_service.get_order_by_sale_id(sale_id)
-            if existing:
-                logger.info(f"Order already exists for sale {sale_id}")
-                return existing
+        # Check if order already exists for this sale (in a worker thread, while
+        # the plan and the order row are prepared below)
+        existing_lookup = (
+            asyncio.create_task(asyncio.to_thread(supabase_service.get_order_by_sale_id, sale_id))
+            if sale_id else None
+        )
 
         # Resolve plan from product info
         plan_type = resolve_plan(str(product_id) if product_id else None, product_name)
         plan_config = get_plan_config(plan_type)
 
         # Determine if this is a test
-        is_test = "test" in event.lower() if event else False
+        is_test = bool(event) and _TEST_EVENT_RE.search(event) is not None
 
-        # Create order in database
         order_data = {
             "sale_id": sale_id or None,
             "plan": plan_type.value,
@@ -73,7 +101,14 @@ class CupidoService:
             "messages_sent": 0,
         }
 
-        order = supabase_service.create_order(order_data)
+        if existing_lookup is not None:
+            existing = await existing_lookup
+            if existing:
+                logger.info(f"Order already exists for sale {sale_id}")
+                return existing
+
+        # Create order in database
+        order = await asyncio.to_thread(supabase_service.create_order, order_data)
         if not order:
             logger.error("Failed to create order in database")
             return None
@@ -82,15 +117,45 @@ class CupidoService:
 
         return order
 
-    async def deliver_single_message(self, order: Dict[str, Any], message_data: Dict[str, Any]) -> bool:
+    @staticmethod
+    def _close_premium_order(order_id: str) -> None:
+        """Mark the premium order delivered in the background (DB clock); the recipient already has the link."""
+        spawn(asyncio.to_thread(supabase_service.mark_premium_delivered, order_id))
+
+    async def _send_audio(
+        self, order_id: str, recipient: str, audio_text: str, message_index: int
+    ) -> Optional[str]:
+        """Generate, upload and send the audio; returns its URL, or None on failure."""
+        audio_url = await elevenlabs_service.generate_send_and_cleanup(
+            audio_text, order_id, recipient, message_index
+        )
+        if audio_url:
+            log_audio_generated(order_id, audio_url)
+        return audio_url
+
+    async def deliver_single_message(self, order: OrderRow, message_data: MessageRow) -> bool:
+        """Deliver a single message and mark it delivered; a failed send is re-queued for the scheduler."""
+        delivery = await self.send_single_message(order, message_data)
+        if delivery is None:
+            if message_data.get("id"):
+                await asyncio.to_thread(supabase_service.record_delivery_failures, [message_data["id"]])
+            return False
+        if delivery["id"]:
+            await asyncio.to_thread(supabase_service.mark_message_delivered, delivery["id"], delivery["audio_url"])
+        return True
+
+    async def send_single_message(
+        self, order: OrderRow, message_data: MessageRow
+    ) -> Optional[Dict[str, Optional[str]]]:
         """
-        Deliver a single message (text + optional audio) to recipient.
-        Handles audio generation, upload, send, and cleanup.
+        Send a single message (text + optional audio) to recipient, without marking it.
+        Handles audio generation, upload, send, and cleanup. Returns its delivery
+        record {"id", "audio_url"} for mark_messages_delivered, or None on failure.
         """
         recipient = order.get("recipient_phone")
         if not recipient:
             logger.error(f"No recipient phone for order {order['id']}")
-            return False
+            return None
 
         message_text = message_data.get("content", "")
         audio_text = message_data.get("audio_text")
@@ -102,107 +167,50 @@ class CupidoService:
 
         # Build formatted text
         if plan_config.max_messages > 1:
-            msg_num = message_index + 1
-            text = (
-                f"💘 *Mensagem Anonima do Cupido* ({msg_num}/{plan_config.max_messages})\n\n"
-                f"_{message_text}_\n\n"
-                f"— {sender_nickname}"
+            text = _MULTI_MESSAGE(
+                n=message_index + 1, total=plan_config.max_messages,
+                body=message_text, who=sender_nickname,
             )
         else:
-            text = (
-                f"💘 *Mensagem Anonima do Cupido*\n\n"
-                f"Alguem especial te enviou uma mensagem"
-                f"{' com audio' if audio_text else ''}:\n\n"
-                f"_{message_text}_\n\n"
-                f"— {sender_nickname}"
+            text = _SINGLE_MESSAGE(
+                with_audio=" com audio" if audio_text else "",
+                body=message_text, who=sender_nickname,
             )
 
-        # If has audio_text, generate and send audio first
-        audio_url = None
-        if audio_text and plan_config.has_audio:
-            audio_url = await elevenlabs_service.generate_send_and_cleanup(
-                audio_text, order["id"], recipient, message_index
-            )
-            if audio_url:
-                log_audio_generated(order["id"], audio_url)
-
-        # Send text message
+        # A failed text is retried later (record_delivery_failures): nothing else goes out
         result = await uazapi_service.send_text(recipient, text)
+        if not result.get("success"):
+            logger.error(f"Text send failed for order {order['id']} message {message_id}")
+            return None
 
-        # Mark message as delivered
-        if message_id:
-            supabase_service.mark_message_delivered(message_id, audio_url)
+        # Audio only after the text made it, so a retry never sends it twice
+        audio_url = None
+        if audio_text and plan_config.has_audio:
+            audio_url = await self._send_audio(order["id"], recipient, audio_text, message_index)
 
         log_message_sent(recipient, order["plan"], has_audio=bool(audio_url))
-        return True
+        return {"id": message_id, "audio_url": audio_url}
 
-    async def deliver_premium(self, order: Dict[str, Any], presentation_id: str, audio_text: str = None) -> bool:
+    async def deliver_premium(self, order: OrderRow, presentation_id: str, audio_text: str = None) -> bool:
         """Deliver premium plan: optional audio + link to slideshow presentation."""
         recipient = order.get("recipient_phone")
         if not recipient:
             return False
 
-        # Generate and send audio first if provided
-        if audio_text:
-            audio_url = await elevenlabs_service.generate_send_and_cleanup(
-                audio_text, order["id"], recipient, 0
-            )
-            if audio_url:
-                log_audio_generated(order["id"], audio_url)
-
-        base = settings.APP_BASE_URL.strip().rstrip("/")
-        presentation_url = f"{base}/p/{presentation_id}"
-
-        text = (
-            f"💘 *Mensagem Anonima do Cupido*\n\n"
-            f"Alguem especial preparou algo muito especial pra voce!\n\n"
-            f"Abra o link abaixo para ver:\n\n"
-            f"👉 {presentation_url}\n\n"
-            f"💌 Feito com amor!"
-        )
-
-        result = await uazapi_service.send_text(recipient, text)
-
-        if result.get("success"):
-            supabase_service.update_order(order["id"], {
-                "status": OrderStatus.DELIVERED.value,
-                "delivered_at": "now()",
-            })
-            log_message_sent(recipient, "premium_historia", has_audio=bool(audio_text))
-            return True
+        presentation_url = f"{settings.APP_BASE_URL}/p/{presentation_id}"
 
-        return False
+        text = _PREMIUM_MESSAGE(url=presentation_url)
 
-    async def deliver_order(self, order: Dict[str, Any]) -> bool:
-        """Deliver an order based on its plan type (used for immediate full delivery)."""
-        plan = order.get("plan")
-        order_id = order.get("id")
-
-        messages = supabase_service.get_messages_by_order(order_id)
-        if not messages:
-            logger.error(f"No messages found for order {order_id}")
+        # Link first: the optional audio only goes out once the link message did
+        result = await uazapi_service.send_text(recipient, text)
+        if not result.get("success"):
             return False
 
-        if plan == PlanType.PREMIUM_HISTORIA.value:
-            # For premium, check if presentation exists
-            presentations = supabase_service.client.table(
-                supabase_service.TABLE_PRESENTATIONS
-            ).select("id").eq("order_id", order_id).limit(1).execute()
-
-            if presentations.data:
-                return await self.deliver_premium(order, presentations.data[0]["id"])
-            else:
-                logger.error(f"No presentation found for premium order {order_id}")
-                return False
-
-        # For all other plans, deliver each message
-        for msg in messages:
-            await self.deliver_single_message(order, msg)
-
-        supabase_service.update_order(order["id"], {
-            "status": OrderStatus.DELIVERED.value,
-            "delivered_at": "now()",
-        })
+        self._close_premium_order(order["id"])
+        audio_url = None
+        if audio_text:
+            audio_url = await self._send_audio(order["id"], recipient, audio_text, 0)
+        log_message_sent(recipient, "premium_historia", has_audio=bool(audio_url))
         return True
 
 
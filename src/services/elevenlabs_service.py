@@ -1,16 +1,33 @@
 """
 Eleven Labs Service - Text-to-Speech for Cupido audio messages
 """
-from typing import Optional
+import asyncio
+import tempfile
+from typing import BinaryIO, Optional
 
 import httpx
 
 from src.config import settings
 from src.services.supabase_service import supabase_service
+from src.services.uazapi_service import uazapi_service
 from src.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Shared HTTP client: TTS calls reuse keep-alive connections to api.elevenlabs.io
+HTTP_TIMEOUT = 60.0
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+WARM_TIMEOUT = 5.0
+
+# MP3 is streamed to a temp file in chunks of this size, then uploaded from it
+AUDIO_CHUNK_SIZE = 64 * 1024
+
+# Retries: connection failures at the transport, 429/5xx/read errors per request
+CONNECT_RETRIES = 2
+TTS_MAX_ATTEMPTS = 3
+TTS_RETRY_BASE_DELAY = 0.5
+TTS_RETRY_MAX_DELAY = 5.0
+
 
 class ElevenLabsService:
     """Text-to-Speech via Eleven Labs API."""
@@ -21,49 +38,116 @@ class ElevenLabsService:
         self.api_key = settings.ELEVENLABS_API_KEY
         self.voice_id = settings.ELEVENLABS_VOICE_ID
         self.model_id = settings.ELEVENLABS_MODEL_ID
-
-    async def generate_audio(self, text: str) -> Optional[bytes]:
-        """Generate MP3 audio from text using Eleven Labs."""
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Long-lived client, created on first use from the running loop."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=HTTP_TIMEOUT,
+                transport=httpx.AsyncHTTPTransport(retries=CONNECT_RETRIES, limits=HTTP_LIMITS),
+                headers={
+                    "xi-api-key": self.api_key,
+                    "Content-Type": "application/json",
+                    "Accept": "audio/mpeg",
+                },
+            )
+        return self._client
+
+    async def warm(self) -> None:
+        """Open a keep-alive connection (TLS included) before the first TTS request."""
+        if not self.api_key:
+            return
+        try:
+            await self._get_client().head(f"{self.API_BASE}/models", timeout=WARM_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Eleven Labs warm-up failed: {e}")
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def generate_audio(self, text: str) -> Optional[BinaryIO]:
+        """
+        Generate MP3 audio from text using Eleven Labs.
+        Streams it into an unbuffered temp file, rewound; the caller closes it.
+        """
         if not self.api_key:
             logger.error("ELEVENLABS_API_KEY not configured")
             return None
 
+        url = f"{self.API_BASE}/text-to-speech/{self.voice_id}"
+        payload = {
+            "text": text,
+            "model_id": self.model_id,
+            "voice_settings": {
+                "stability": 0.5,
+                "similarity_boost": 0.75,
+            },
+        }
+
+        audio = tempfile.TemporaryFile(buffering=0)
         try:
-            url = f"{self.API_BASE}/text-to-speech/{self.voice_id}"
-
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    url,
-                    headers={
-                        "xi-api-key": self.api_key,
-                        "Content-Type": "application/json",
-                        "Accept": "audio/mpeg",
-                    },
-                    json={
-                        "text": text,
-                        "model_id": self.model_id,
-                        "voice_settings": {
-                            "stability": 0.5,
-                            "similarity_boost": 0.75,
-                        },
-                    },
-                )
-                response.raise_for_status()
-                logger.info(f"Audio generated: {len(response.content)} bytes")
-                return response.content
+            for attempt in range(1, TTS_MAX_ATTEMPTS + 1):
+                audio.seek(0)
+                audio.truncate()
+                try:
+                    async with self._get_client().stream("POST", url, json=payload) as response:
+                        response.raise_for_status()
+                        async for chunk in response.aiter_bytes(AUDIO_CHUNK_SIZE):
+                            audio.write(chunk)
+                    break
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    logger.warning(f"Eleven Labs attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+            logger.info(f"Audio generated: {audio.tell()} bytes")
+            audio.seek(0)
+            return audio
 
         except Exception as e:
+            audio.close()
             logger.error(f"Error generating audio: {e}")
             return None
 
-    async def generate_and_upload(self, text: str, order_id: str, message_index: int = 0) -> Optional[str]:
-        """Generate audio and upload to Supabase Storage. Returns public URL."""
-        audio_bytes = await self.generate_audio(text)
-        if not audio_bytes:
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying a TTS call, or None if it shouldn't be retried."""
+        if attempt >= TTS_MAX_ATTEMPTS:
             return None
 
+        backoff = min(TTS_RETRY_MAX_DELAY, TTS_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+        if isinstance(error, httpx.TransportError):
+            return backoff
+
+        status = error.response.status_code
+        if status == 429:
+            # Honour Retry-After (seconds) when present, within the same cap
+            try:
+                return min(TTS_RETRY_MAX_DELAY, float(error.response.headers["retry-after"]))
+            except (KeyError, ValueError):
+                return backoff
+        if status >= 500:
+            return backoff
+        return None
+
+    async def _generate_and_store(self, text: str, file_path: str) -> Optional[str]:
+        """Generate audio and upload it to Supabase Storage. Returns public URL."""
+        audio = await self.generate_audio(text)
+        if not audio:
+            return None
+
+        with audio:
+            return await asyncio.to_thread(supabase_service.upload_file, file_path, audio, "audio/mpeg")
+
+    async def generate_and_upload(self, text: str, order_id: str, message_index: int = 0) -> Optional[str]:
+        """Generate audio and upload to Supabase Storage. Returns public URL."""
         file_path = f"audio/{order_id}_{message_index}.mp3"
-        public_url = supabase_service.upload_file(file_path, audio_bytes, "audio/mpeg")
+        public_url = await self._generate_and_store(text, file_path)
 
         if public_url:
             logger.info(f"Audio uploaded for order {order_id}: {public_url}")
@@ -74,14 +158,8 @@ class ElevenLabsService:
         self, text: str, order_id: str, recipient_phone: str, message_index: int = 0
     ) -> Optional[str]:
         """Generate audio, upload, send via WhatsApp, then delete from storage."""
-        from src.services.uazapi_service import uazapi_service
-
-        audio_bytes = await self.generate_audio(text)
-        if not audio_bytes:
-            return None
-
         file_path = f"audio/{order_id}_{message_index}.mp3"
-        public_url = supabase_service.upload_file(file_path, audio_bytes, "audio/mpeg")
+        public_url = await self._generate_and_store(text, file_path)
 
         if not public_url:
             return None
@@ -91,13 +169,13 @@ class ElevenLabsService:
         # Send audio via WhatsApp
         result = await uazapi_service.send_audio(recipient_phone, public_url)
 
-        # Cleanup: only delete from storage after successful send
-        if result.get("success"):
-            supabase_service.delete_file(file_path)
-            logger.info(f"Audio cleaned up from storage: {file_path}")
-        else:
-            logger.warning(f"Audio send failed, keeping file in storage: {file_path}")
+        # Cleanup either way: a failed audio is not re-sent, nothing would reuse the file
+        await asyncio.to_thread(supabase_service.delete_file, file_path)
+        logger.info(f"Audio cleaned up from storage: {file_path}")
 
+        if not result.get("success"):
+            logger.warning(f"Audio send failed for order {order_id}")
+            return None
         return public_url
 
 
@@ -1,50 +1,148 @@
 """
 Fidelidade Service - Business logic for Teste de Fidelidade
 """
+import asyncio
 import secrets
+import threading
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional
+from functools import cached_property
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import bcrypt
 import jwt
+from cachetools import TTLCache
 
 from src.config import settings
+from src.services.pg_pool import pg_pool
+from src.services.redis_service import redis_service
 from src.services.supabase_service import supabase_service
 from src.services.uazapi_service import uazapi_service
+from src.utils.background import spawn
 from src.utils.logger import get_logger
-from src.utils.validators import clean_phone_for_whatsapp
+from src.utils.validators import clean_phone_for_whatsapp, parse_utc_timestamp
 
 logger = get_logger(__name__)
 
 JWT_SECRET = settings.FIDELIDADE_JWT_SECRET or settings.SUPABASE_KEY
 JWT_ALGORITHM = "HS256"
+# HMAC key as bytes once, so PyJWT doesn't re-encode the secret per sign/verify
+_JWT_KEY = JWT_SECRET.encode("utf-8")
 JWT_EXPIRATION_DAYS = 7
+BCRYPT_ROUNDS = settings.BCRYPT_COST
+# senha_hash of quick-test users: no bcrypt hash matches it, so password login is impossible
+UNUSABLE_PASSWORD_HASH = "!quick"
+_BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
 ACCESS_DURATION_HOURS = 48
 
+# Verified tokens (raw token -> (user_id, exp)). Pages fire several API calls
+# each, so the HMAC check runs once per token per TTL; entries never outlive exp.
+TOKEN_CACHE_TTL = 300
+TOKEN_CACHE_SIZE = 10_000
+
+# Column projections: the panel list, and what send_message checks on a test
+TEST_LIST_COLUMNS = "id, target_phone, status, created_at, expires_at"
+TEST_CHECK_COLUMNS = "id, user_id, target_phone, status, expires_at"
+
+# Redis copies of test/user rows for chat polling; writes to a test drop its copy
+TEST_CACHE_TTL = 30
+USER_CACHE_TTL = 30
+
+# Locked-chat masks: 3 visible chars + up to 30 blocks, short messages get 10
+BLUR_VISIBLE_CHARS = 3
+_BLUR_MASK = "█" * 30
+_BLUR_SHORT = "█" * 10
+
+# Target replies within this window after the first one go out as a single
+# owner notification (one UAZAPI send per burst instead of one per message)
+NOTIFY_WINDOW_SECONDS = 5
+NOTIFY_PREVIEW_CHARS = 50
+
+# Buyer follow-ups after a quick test, as seconds from the start of the sequence:
+# the first 10 minutes in, the others 10s and 15s after it
+FOLLOWUP_BASE_DELAY = 600
+_FOLLOWUP_CHECKOUT_MESSAGE = (
+    "se for querer tu so precisa mandar o valor por esse link colocando o mesmo numero "
+    "do seu zap e mandar o comprovante aqui, esse e um numero que usamos para nao desconfiarem\n\n{}"
+).format
+
+_OWNER_NOTIFICATION = (
+    "🔔 *Teste de Fidelidade*\n\n"
+    "O numero {masked} {replied}\n\n"
+    "{previews}\n\n"
+    "Acesse o chat para ver:\n"
+    "👉 {chat_url}"
+).format
+
 
 class FidelidadeService:
     """Core service for Teste de Fidelidade."""
 
+    def __init__(self):
+        self._token_cache: TTLCache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+        self._token_cache_lock = threading.Lock()
+        # Fixed for the process lifetime; bound once for the send/notify paths
+        self._uazapi_token = settings.FIDELIDADE_UAZAPI_TOKEN
+        self._followup_messages: Tuple[Tuple[float, str], ...] = (
+            (FOLLOWUP_BASE_DELAY, "Oi amiga, ele respondeu"),
+            (FOLLOWUP_BASE_DELAY + 10, "Nao sei se vc vai querer tirar essa duvida"),
+            (FOLLOWUP_BASE_DELAY + 15, _FOLLOWUP_CHECKOUT_MESSAGE(settings.FIDELIDADE_CHECKOUT_URL)),
+        )
+        self._chat_base = settings.APP_BASE_URL
+        # test_id -> reply contents waiting for the window's owner notification
+        self._pending_notifications: Dict[str, List[str]] = {}
+
     # ── Auth ───────────────────────────────────────────────────────
 
     def hash_password(self, password: str) -> str:
-        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+        return bcrypt.hashpw(
+            password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+        ).decode("utf-8")
+
+    @cached_property
+    def _dummy_hash(self) -> bytes:
+        """Hash checked for unknown emails, so login takes the same time either way."""
+        return bcrypt.hashpw(secrets.token_bytes(16), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+
+    def password_needs_rehash(self, hashed: str) -> bool:
+        """True for hashes weaker than BCRYPT_ROUNDS ("$2b$10$..."); stronger ones are never downgraded."""
+        try:
+            return int(hashed.split("$")[2]) < BCRYPT_ROUNDS
+        except (IndexError, ValueError):
+            return False
 
     def verify_password(self, password: str, hashed: str) -> bool:
+        if not hashed or not hashed.startswith(_BCRYPT_PREFIXES):
+            # Quick-test marker or a malformed hash: can never match, skip bcrypt.
+            # Quick-test accounts live under synthetic emails, so the fast reply
+            # reveals nothing about a real user's address
+            return False
         return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
 
     def create_token(self, user_id: str) -> str:
-        payload = {
-            "user_id": user_id,
-            "exp": datetime.now(timezone.utc) + timedelta(days=JWT_EXPIRATION_DAYS),
-        }
-        return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+        exp = datetime.now(timezone.utc) + timedelta(days=JWT_EXPIRATION_DAYS)
+        token = jwt.encode({"user_id": user_id, "exp": exp}, _JWT_KEY, algorithm=JWT_ALGORITHM)
+        # Seed the verify cache: the client presents this token right after login
+        with self._token_cache_lock:
+            self._token_cache[token] = (user_id, int(exp.timestamp()))
+        return token
 
     def verify_token(self, token: str) -> Optional[str]:
-        """Decode JWT and return user_id, or None if invalid."""
+        """Decode JWT and return user_id, or None if invalid (valid tokens are cached until exp)."""
+        with self._token_cache_lock:
+            cached = self._token_cache.get(token)
+        if cached is not None:
+            user_id, exp = cached
+            if exp > time.time():
+                return user_id
+
         try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-            return payload.get("user_id")
+            payload = jwt.decode(token, _JWT_KEY, algorithms=[JWT_ALGORITHM])
+            user_id = payload.get("user_id")
+            if user_id:
+                with self._token_cache_lock:
+                    self._token_cache[token] = (user_id, payload["exp"])
+            return user_id
         except jwt.ExpiredSignatureError:
             logger.warning("Token expired")
             return None
@@ -55,57 +153,48 @@ class FidelidadeService:
     # ── Users ──────────────────────────────────────────────────────
 
     def register_user(self, nome: str, email: str, telefone: str, senha: str) -> Dict[str, Any]:
-        """Register a new fidelidade user."""
+        """Register a new fidelidade user (email already normalized by the caller)."""
         try:
-            # Check if email already exists
-            existing = (
-                supabase_service.client.table("fidelidade_users")
-                .select("id")
-                .eq("email", email.lower())
-                .limit(1)
-                .execute()
-            )
-            if existing.data:
-                return {"success": False, "error": "Email ja cadastrado"}
-
             telefone_clean = clean_phone_for_whatsapp(telefone)
             senha_hash = self.hash_password(senha)
 
-            response = (
-                supabase_service.client.table("fidelidade_users")
-                .insert({
-                    "nome": nome.strip(),
-                    "email": email.lower().strip(),
-                    "telefone": telefone_clean,
-                    "senha_hash": senha_hash,
-                })
-                .execute()
-            )
+            # Email check + insert in one call (RPC, serialized per email)
+            response = supabase_service.client.rpc("register_fidelidade_user", {
+                "p_nome": nome.strip(),
+                "p_email": email,
+                "p_telefone": telefone_clean,
+                "p_senha_hash": senha_hash,
+            }).execute()
 
-            if response.data:
-                user = response.data[0]
-                token = self.create_token(user["id"])
-                logger.info(f"Fidelidade user registered: {email}")
-                return {"success": True, "token": token, "user_id": user["id"]}
+            if not response.data:
+                return {"success": False, "error": "Erro ao criar conta"}
+
+            row = response.data[0]
+            if not row["created"]:
+                return {"success": False, "error": "Email ja cadastrado"}
 
-            return {"success": False, "error": "Erro ao criar conta"}
+            token = self.create_token(row["user_id"])
+            logger.info(f"Fidelidade user registered: {email}")
+            return {"success": True, "token": token, "user_id": row["user_id"]}
 
         except Exception as e:
             logger.error(f"Error registering user: {e}")
             return {"success": False, "error": "Erro interno"}
 
     def login_user(self, email: str, senha: str) -> Dict[str, Any]:
-        """Login fidelidade user."""
+        """Login fidelidade user (email already normalized by the caller)."""
         try:
             response = (
                 supabase_service.client.table("fidelidade_users")
-                .select("*")
-                .eq("email", email.lower().strip())
+                .select("id, senha_hash")
+                .eq("email", email)
                 .limit(1)
                 .execute()
             )
 
             if not response.data:
+                # Same bcrypt work as a wrong password: no timing oracle for registered emails
+                bcrypt.checkpw(senha.encode("utf-8"), self._dummy_hash)
                 return {"success": False, "error": "Email ou senha incorretos"}
 
             user = response.data[0]
@@ -113,6 +202,10 @@ class FidelidadeService:
             if not self.verify_password(senha, user["senha_hash"]):
                 return {"success": False, "error": "Email ou senha incorretos"}
 
+            # Lazily move old hashes to the configured cost (off the login response)
+            if self.password_needs_rehash(user["senha_hash"]):
+                spawn(asyncio.to_thread(self._rehash_password, user["id"], senha))
+
             token = self.create_token(user["id"])
             logger.info(f"Fidelidade user logged in: {email}")
             return {"success": True, "token": token, "user_id": user["id"]}
@@ -121,15 +214,36 @@ class FidelidadeService:
             logger.error(f"Error logging in: {e}")
             return {"success": False, "error": "Erro interno"}
 
-    def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Get user by ID."""
+    def _rehash_password(self, user_id: str, senha: str) -> None:
+        """Store a fresh hash of a just-verified password."""
         try:
-            response = (
+            supabase_service.client.table("fidelidade_users").update({
+                "senha_hash": self.hash_password(senha),
+            }).eq("id", user_id).execute()
+            logger.info(f"Password hash upgraded for user {user_id}")
+        except Exception as e:
+            logger.error(f"Error upgrading password hash for user {user_id}: {e}")
+
+    async def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get user by ID (cached in Redis for USER_CACHE_TTL)."""
+        return await redis_service.get_or_set(
+            f"fidelidade:user:{user_id}", USER_CACHE_TTL, lambda: self._load_user(user_id)
+        )
+
+    async def _load_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Hot read: asyncpg when available."""
+        try:
+            if pg_pool.available:
+                return await pg_pool.fetchrow(
+                    "SELECT id, nome, email, telefone, created_at FROM fidelidade_users WHERE id = $1",
+                    user_id,
+                )
+            response = await asyncio.to_thread(
                 supabase_service.client.table("fidelidade_users")
                 .select("id, nome, email, telefone, created_at")
                 .eq("id", user_id)
                 .limit(1)
-                .execute()
+                .execute
             )
             return response.data[0] if response.data else None
         except Exception as e:
@@ -186,16 +300,13 @@ class FidelidadeService:
         try:
             target_clean = clean_phone_for_whatsapp(target_phone)
 
-            # Create test record
-            response = (
-                supabase_service.client.table("fidelidade_tests")
-                .insert({
-                    "user_id": user_id,
-                    "target_phone": target_clean,
-                    "first_message": first_message,
-                    "status": "pending",
-                })
-                .execute()
+            # Create test record + its first message in one transaction (RPC)
+            response = await asyncio.to_thread(
+                supabase_service.client.rpc("create_test_with_message", {
+                    "p_user_id": user_id,
+                    "p_target_phone": target_clean,
+                    "p_message": first_message,
+                }).execute
             )
 
             if not response.data:
@@ -204,22 +315,10 @@ class FidelidadeService:
             test = response.data[0]
             test_id = test["id"]
 
-            # Send first message via UAZAPI (from the "woman" number)
-            result = await uazapi_service.send_text(
-                target_clean,
-                first_message,
-                token=settings.FIDELIDADE_UAZAPI_TOKEN,
-            )
-
-            if not result.get("success"):
-                logger.error(f"Failed to send first message for test {test_id}")
-
-            # Save message record
-            supabase_service.client.table("fidelidade_messages").insert({
-                "test_id": test_id,
-                "direction": "outbound",
-                "content": first_message,
-            }).execute()
+            # Send first message via UAZAPI (from the "woman" number) in the
+            # background outbox; send_text logs the outcome
+            if not uazapi_service.enqueue_text(target_clean, first_message, token=self._uazapi_token):
+                logger.error(f"Failed to queue first message for test {test_id}")
 
             logger.info(f"Fidelidade test created: {test_id}")
             return {"success": True, "test_id": test_id}
@@ -229,38 +328,55 @@ class FidelidadeService:
             return {"success": False, "error": "Erro interno"}
 
     def get_user_tests(self, user_id: str) -> List[Dict[str, Any]]:
-        """Get all tests for a user."""
+        """Get all tests for a user (overdue active tests are expired in the same RPC)."""
         try:
             response = (
-                supabase_service.client.table("fidelidade_tests")
-                .select("*")
-                .eq("user_id", user_id)
-                .order("created_at", desc=True)
+                supabase_service.client.rpc("expire_and_list_tests", {"p_user_id": user_id})
+                .select(TEST_LIST_COLUMNS)
                 .execute()
             )
-            tests = response.data or []
-            # Update expired tests
-            now = datetime.now(timezone.utc)
-            for test in tests:
-                if test["status"] == "active" and test.get("expires_at"):
-                    expires = datetime.fromisoformat(test["expires_at"].replace("Z", "+00:00"))
-                    if now > expires:
-                        self._expire_test(test["id"])
-                        test["status"] = "expired"
-            return tests
+            return response.data or []
         except Exception as e:
             logger.error(f"Error getting tests: {e}")
             return []
 
-    def get_test(self, test_id: str) -> Optional[Dict[str, Any]]:
-        """Get a single test by ID."""
+    @staticmethod
+    def test_cache_key(test_id: str) -> str:
+        return f"fidelidade:test:{test_id}"
+
+    def _invalidate_test(self, test_id: str) -> None:
+        """Drop the cached copy of a test (fire-and-forget, safe from worker threads)."""
+        if redis_service.available:
+            spawn(redis_service.delete(self.test_cache_key(test_id)))
+
+    async def get_test(self, test_id: str) -> Optional[Dict[str, Any]]:
+        """Get a test's TEST_CHECK_COLUMNS by ID (cached in Redis for TEST_CACHE_TTL once paid)."""
+        key = self.test_cache_key(test_id)
+        test = await redis_service.get_json(key)
+        if test is not None:
+            return test
+
+        test = await self._load_test(test_id)
+        # Pending tests flip to active on payment: a read racing the activation
+        # could re-cache the pending copy after its invalidation, so only
+        # settled (paid/expired) rows are cached
+        if test and test.get("status") != "pending":
+            await redis_service.set_json(key, test, TEST_CACHE_TTL)
+        return test
+
+    async def _load_test(self, test_id: str) -> Optional[Dict[str, Any]]:
+        """Hot read: asyncpg when available."""
         try:
-            response = (
+            if pg_pool.available:
+                return await pg_pool.fetchrow(
+                    f"SELECT {TEST_CHECK_COLUMNS} FROM fidelidade_tests WHERE id = $1", test_id
+                )
+            response = await asyncio.to_thread(
                 supabase_service.client.table("fidelidade_tests")
-                .select("*")
+                .select(TEST_CHECK_COLUMNS)
                 .eq("id", test_id)
                 .limit(1)
-                .execute()
+                .execute
             )
             return response.data[0] if response.data else None
         except Exception as e:
@@ -280,14 +396,14 @@ class FidelidadeService:
 
         try:
             if isinstance(expires_at, str):
-                expires = datetime.fromisoformat(expires_at.replace("Z", "+00:00"))
+                expires = parse_utc_timestamp(expires_at)
             elif isinstance(expires_at, datetime):
-                expires = expires_at if expires_at.tzinfo else expires_at.replace(tzinfo=timezone.utc)
+                expires = (expires_at if expires_at.tzinfo else expires_at.replace(tzinfo=timezone.utc)).timestamp()
             else:
                 logger.error(f"Unknown expires_at type: {type(expires_at)} for test {test.get('id')}")
                 return True  # Benefit of the doubt — customer paid
 
-            return datetime.now(timezone.utc) < expires
+            return time.time() < expires
         except Exception as e:
             logger.error(f"Error parsing expires_at for test {test.get('id')}: {e}")
             return True  # Can't check expiration — assume active, customer paid
@@ -296,14 +412,21 @@ class FidelidadeService:
 
     def get_messages(self, test_id: str, user_id: str) -> Dict[str, Any]:
         """Get messages for a test. Blur if not paid/expired."""
-        test = self.get_test(test_id)
+        try:
+            response = supabase_service.client.rpc(
+                "get_test_with_messages", {"p_test_id": test_id, "p_user_id": user_id}
+            ).execute()
+            test = response.data
+        except Exception as e:
+            logger.error(f"Error getting messages: {e}")
+            test = None
+
+        # Unknown test and someone else's test look the same to the caller
         if not test:
-            logger.warning(f"get_messages: test {test_id} not found")
+            logger.warning(f"get_messages: test {test_id} not found for user {user_id}")
             return {"success": False, "error": "Teste nao encontrado"}
 
-        if test["user_id"] != user_id:
-            logger.warning(f"get_messages: user mismatch test={test_id} test_user={test['user_id']} req_user={user_id}")
-            return {"success": False, "error": "Acesso negado"}
+        messages = test.pop("messages", None) or []
 
         # Check expiration
         active = self.is_test_active(test)
@@ -312,34 +435,17 @@ class FidelidadeService:
             self._expire_test(test_id)
             test["status"] = "expired"
 
-        try:
-            response = (
-                supabase_service.client.table("fidelidade_messages")
-                .select("*")
-                .eq("test_id", test_id)
-                .order("created_at")
-                .execute()
-            )
-            messages = response.data or []
-        except Exception as e:
-            logger.error(f"Error getting messages: {e}")
-            messages = []
-
         blurred = not active
 
         if blurred:
-            # Return messages with content hidden
+            # Return messages with content hidden; unlocked chats only carry the top-level flag
             for msg in messages:
                 msg["blurred"] = True
-                # Keep first 3 chars visible + blur rest
                 content = msg["content"]
-                if len(content) > 3:
-                    msg["content"] = content[:3] + "█" * min(len(content) - 3, 30)
+                if len(content) > BLUR_VISIBLE_CHARS:
+                    msg["content"] = content[:BLUR_VISIBLE_CHARS] + _BLUR_MASK[:len(content) - BLUR_VISIBLE_CHARS]
                 else:
-                    msg["content"] = "█" * 10
-        else:
-            for msg in messages:
-                msg["blurred"] = False
+                    msg["content"] = _BLUR_SHORT
 
         return {
             "success": True,
@@ -350,8 +456,11 @@ class FidelidadeService:
         }
 
     async def send_message(self, test_id: str, user_id: str, content: str) -> Dict[str, Any]:
-        """Send a message in an active test (user acting as the 'woman')."""
-        test = self.get_test(test_id)
+        """
+        Queue a message in an active test (user acting as the 'woman'). Success means
+        it was accepted by the outbox (status "queued"), not that WhatsApp delivered it.
+        """
+        test = await self.get_test(test_id)
         if not test:
             return {"success": False, "error": "Teste nao encontrado"}
 
@@ -362,25 +471,22 @@ class FidelidadeService:
             return {"success": False, "error": "Teste nao esta ativo ou expirou"}
 
         try:
-            # Send via UAZAPI
-            result = await uazapi_service.send_text(
-                test["target_phone"],
-                content,
-                token=settings.FIDELIDADE_UAZAPI_TOKEN,
-            )
-
-            if not result.get("success"):
+            # Send via UAZAPI in the background outbox (like create_test), so the
+            # chat doesn't wait on the gateway; a dropped send isn't saved
+            if not uazapi_service.enqueue_text(test["target_phone"], content, token=self._uazapi_token):
                 return {"success": False, "error": "Falha ao enviar mensagem"}
 
             # Save message
-            supabase_service.client.table("fidelidade_messages").insert({
-                "test_id": test_id,
-                "direction": "outbound",
-                "content": content,
-            }).execute()
+            await asyncio.to_thread(
+                supabase_service.client.table("fidelidade_messages").insert({
+                    "test_id": test_id,
+                    "direction": "outbound",
+                    "content": content,
+                }).execute
+            )
 
-            logger.info(f"Fidelidade message sent for test {test_id}")
-            return {"success": True}
+            logger.info(f"Fidelidade message queued for test {test_id}")
+            return {"success": True, "status": "queued"}
 
         except Exception as e:
             logger.error(f"Error sending message: {e}")
@@ -393,43 +499,24 @@ class FidelidadeService:
         try:
             phone_clean = clean_phone_for_whatsapp(phone)
 
-            # Busca por telefone
-            existing = (
-                supabase_service.client.table("fidelidade_users")
-                .select("id")
-                .eq("telefone", phone_clean)
-                .limit(1)
-                .execute()
-            )
-            if existing.data:
-                user_id = existing.data[0]["id"]
-                token = self.create_token(user_id)
-                logger.info(f"Quick test: reusing user {user_id} for phone {phone_clean[:7]}...")
-                return {"success": True, "user_id": user_id, "token": token}
-
-            # Cria com email sintetico e senha random
-            synthetic_email = f"{phone_clean}@fidelidade.local"
-            random_password = secrets.token_urlsafe(16)
-            senha_hash = self.hash_password(random_password)
-
-            response = (
-                supabase_service.client.table("fidelidade_users")
-                .insert({
-                    "nome": nome.strip(),
-                    "email": synthetic_email,
-                    "telefone": phone_clean,
-                    "senha_hash": senha_hash,
-                })
-                .execute()
-            )
+            # Busca por telefone, ou cria com email sintetico e sem senha
+            # (acesso so por telefone/token) - uma chamada (RPC)
+            response = supabase_service.client.rpc("find_or_create_fidelidade_user_by_phone", {
+                "p_nome": nome.strip(),
+                "p_telefone": phone_clean,
+                "p_email": f"{phone_clean}@fidelidade.local",
+                "p_senha_hash": UNUSABLE_PASSWORD_HASH,
+            }).execute()
 
-            if response.data:
-                user = response.data[0]
-                token = self.create_token(user["id"])
-                logger.info(f"Quick test: created user {user['id']} for phone {phone_clean[:7]}...")
-                return {"success": True, "user_id": user["id"], "token": token}
+            if not response.data:
+                return {"success": False, "error": "Erro ao criar conta"}
 
-            return {"success": False, "error": "Erro ao criar conta"}
+            row = response.data[0]
+            user_id = row["user_id"]
+            token = self.create_token(user_id)
+            action = "created" if row["created"] else "reusing"
+            logger.info(f"Quick test: {action} user {user_id} for phone {phone_clean[:7]}...")
+            return {"success": True, "user_id": user_id, "token": token}
 
         except Exception as e:
             logger.error(f"Error in quick_create_user_or_find: {e}")
@@ -447,8 +534,8 @@ class FidelidadeService:
             if buyer_clean == target_clean:
                 return {"success": False, "error": "O WhatsApp dele precisa ser diferente do seu"}
 
-            # Create/find user
-            user_result = self.quick_create_user_or_find(nome, buyer_phone)
+            # Create/find user (sync DB + bcrypt for new users: keep it off the loop)
+            user_result = await asyncio.to_thread(self.quick_create_user_or_find, nome, buyer_phone)
             if not user_result["success"]:
                 return user_result
 
@@ -456,14 +543,14 @@ class FidelidadeService:
             token = user_result["token"]
 
             # Check duplicata (mesmo user + mesmo target com teste pending/active)
-            dup = (
+            dup = await asyncio.to_thread(
                 supabase_service.client.table("fidelidade_tests")
                 .select("id")
                 .eq("user_id", user_id)
                 .eq("target_phone", target_clean)
                 .in_("status", ["pending", "active"])
                 .limit(1)
-                .execute()
+                .execute
             )
             if dup.data:
                 # Reutiliza o teste existente
@@ -490,47 +577,27 @@ class FidelidadeService:
     def _schedule_followup_messages(self, buyer_phone: str, test_id: str) -> None:
         """Schedule 3 follow-up messages to the buyer after ~10 minutes."""
         try:
-            # Lazy import to avoid circular import (scheduler lives in api.py)
-            from src.api import scheduler
-
-            now = datetime.now(timezone.utc)
-            base_delay = timedelta(minutes=10)
-
-            checkout_url = settings.FIDELIDADE_CHECKOUT_URL
-
-            messages = [
-                (base_delay, "Oi amiga, ele respondeu"),
-                (base_delay + timedelta(seconds=10), "Nao sei se vc vai querer tirar essa duvida"),
-                (
-                    base_delay + timedelta(seconds=15),
-                    f"se for querer tu so precisa mandar o valor por esse link colocando o mesmo numero do seu zap e mandar o comprovante aqui, esse e um numero que usamos para nao desconfiarem\n\n{checkout_url}",
-                ),
-            ]
-
-            for i, (delay, text) in enumerate(messages):
-                run_at = now + delay
-                job_id = f"fidelidade_followup_{test_id}_{i}"
-                scheduler.add_job(
-                    self._send_followup_message,
-                    "date",
-                    run_date=run_at,
-                    args=[buyer_phone, text],
-                    id=job_id,
-                    replace_existing=True,
-                )
+            spawn(self._run_followup_messages(buyer_phone, self._followup_messages))
 
             logger.info(f"Scheduled 3 followup messages for test {test_id}")
 
         except Exception as e:
             logger.error(f"Error scheduling followup messages: {e}")
 
+    async def _run_followup_messages(self, buyer_phone: str, messages: Sequence[Tuple[float, str]]) -> None:
+        """Send each (delay seconds, text) followup at start + delay (monotonic clock), as one task."""
+        start = time.monotonic()
+        for delay, text in messages:
+            await asyncio.sleep(max(0.0, start + delay - time.monotonic()))
+            await self._send_followup_message(buyer_phone, text)
+
     async def _send_followup_message(self, buyer_phone: str, text: str) -> None:
         """Send a single follow-up message to the buyer's WhatsApp."""
         try:
             result = await uazapi_service.send_text(
                 buyer_phone,
                 text,
-                token=settings.FIDELIDADE_UAZAPI_TOKEN,
+                token=self._uazapi_token,
             )
             if result.get("success"):
                 logger.info(f"Followup sent to {buyer_phone[:7]}...")
@@ -542,13 +609,13 @@ class FidelidadeService:
     # ── Payment ────────────────────────────────────────────────────
 
     def activate_test_by_email(self, email: str, sale_id: str) -> Dict[str, Any]:
-        """Activate a pending test when payment is confirmed."""
+        """Activate a pending test when payment is confirmed (email already normalized)."""
         try:
             # Find user by email
             user_resp = (
                 supabase_service.client.table("fidelidade_users")
                 .select("id")
-                .eq("email", email.lower().strip())
+                .eq("email", email)
                 .limit(1)
                 .execute()
             )
@@ -562,7 +629,7 @@ class FidelidadeService:
             # Find most recent pending test
             test_resp = (
                 supabase_service.client.table("fidelidade_tests")
-                .select("*")
+                .select("id")
                 .eq("user_id", user_id)
                 .eq("status", "pending")
                 .order("created_at", desc=True)
@@ -575,8 +642,9 @@ class FidelidadeService:
                 return {"success": False, "error": "Nenhum teste pendente"}
 
             test = test_resp.data[0]
-            now = datetime.now(timezone.utc).isoformat()
-            expires = (datetime.now(timezone.utc) + timedelta(hours=ACCESS_DURATION_HOURS)).isoformat()
+            activated_at = datetime.now(timezone.utc)
+            now = activated_at.isoformat()
+            expires = (activated_at + timedelta(hours=ACCESS_DURATION_HOURS)).isoformat()
 
             supabase_service.client.table("fidelidade_tests").update({
                 "status": "active",
@@ -584,6 +652,7 @@ class FidelidadeService:
                 "paid_at": now,
                 "expires_at": expires,
             }).eq("id", test["id"]).execute()
+            self._invalidate_test(test["id"])
 
             logger.info(f"Fidelidade test activated: {test['id']} (sale: {sale_id})")
             return {"success": True, "test_id": test["id"]}
@@ -613,7 +682,7 @@ class FidelidadeService:
 
             test_resp = (
                 supabase_service.client.table("fidelidade_tests")
-                .select("*")
+                .select("id")
                 .eq("user_id", user_id)
                 .eq("status", "pending")
                 .order("created_at", desc=True)
@@ -626,8 +695,9 @@ class FidelidadeService:
                 return {"success": False, "error": "Nenhum teste pendente"}
 
             test = test_resp.data[0]
-            now = datetime.now(timezone.utc).isoformat()
-            expires = (datetime.now(timezone.utc) + timedelta(hours=ACCESS_DURATION_HOURS)).isoformat()
+            activated_at = datetime.now(timezone.utc)
+            now = activated_at.isoformat()
+            expires = (activated_at + timedelta(hours=ACCESS_DURATION_HOURS)).isoformat()
 
             supabase_service.client.table("fidelidade_tests").update({
                 "status": "active",
@@ -635,6 +705,7 @@ class FidelidadeService:
                 "paid_at": now,
                 "expires_at": expires,
             }).eq("id", test["id"]).execute()
+            self._invalidate_test(test["id"])
 
             logger.info(f"Fidelidade test activated by phone: {test['id']} (sale: {sale_id})")
             return {"success": True, "test_id": test["id"]}
@@ -650,15 +721,15 @@ class FidelidadeService:
         try:
             sender_clean = clean_phone_for_whatsapp(sender_phone)
 
-            # Find active/pending test where target_phone matches
-            response = (
+            # Find active/pending test where target_phone matches, with the owner's phone
+            response = await asyncio.to_thread(
                 supabase_service.client.table("fidelidade_tests")
-                .select("*")
+                .select("id, user_id, target_phone, status, expires_at, owner:fidelidade_users(telefone)")
                 .eq("target_phone", sender_clean)
                 .in_("status", ["pending", "active"])
                 .order("created_at", desc=True)
                 .limit(1)
-                .execute()
+                .execute
             )
 
             if not response.data:
@@ -667,15 +738,18 @@ class FidelidadeService:
 
             test = response.data[0]
 
-            # Save inbound message
-            supabase_service.client.table("fidelidade_messages").insert({
-                "test_id": test["id"],
-                "direction": "inbound",
-                "content": content,
-            }).execute()
+            # Notify the test owner via WhatsApp in the background (batched per
+            # NOTIFY_WINDOW_SECONDS); the webhook doesn't wait on the send
+            self._queue_owner_notification(test, content)
 
-            # Notify the test owner via WhatsApp
-            await self._notify_owner(test, content)
+            # Save inbound message
+            await asyncio.to_thread(
+                supabase_service.client.table("fidelidade_messages").insert({
+                    "test_id": test["id"],
+                    "direction": "inbound",
+                    "content": content,
+                }).execute
+            )
 
             logger.info(f"Inbound message saved for test {test['id']}")
             return {"success": True, "test_id": test["id"]}
@@ -686,30 +760,42 @@ class FidelidadeService:
 
     # ── Helpers ─────────────────────────────────────────────────────
 
-    async def _notify_owner(self, test: Dict[str, Any], message_content: str) -> None:
-        """Send WhatsApp notification to test owner when target replies."""
+    def _queue_owner_notification(self, test: Dict[str, Any], message_content: str) -> None:
+        """Add a reply to the test's pending notification; the first reply of a burst starts the window."""
+        pending = self._pending_notifications.get(test["id"])
+        if pending is not None:
+            pending.append(message_content)
+            return
+        self._pending_notifications[test["id"]] = [message_content]
+        spawn(self._notify_owner(test))
+
+    async def _notify_owner(self, test: Dict[str, Any]) -> None:
+        """Send one WhatsApp notification to the test owner for the replies of a window."""
+        await asyncio.sleep(NOTIFY_WINDOW_SECONDS)
+        contents = self._pending_notifications.pop(test["id"], [])
+        if not contents:
+            return
+
         try:
-            # Get owner user
-            user = self.get_user(test["user_id"])
+            # Owner comes embedded from the inbound lookup; fetch it only if missing
+            user = test.get("owner") or await self.get_user(test["user_id"])
             if not user:
                 return
 
             phone_alvo = test["target_phone"]
             masked = phone_alvo[:4] + "****" + phone_alvo[-4:]
 
-            chat_url = f"{settings.APP_BASE_URL}/fidelidade/chat/{test['id']}"
+            chat_url = f"{self._chat_base}/fidelidade/chat/{test['id']}"
 
-            # Preview of the message (first 50 chars)
-            preview = message_content[:50]
-            if len(message_content) > 50:
-                preview += "..."
+            # Preview of each message (first 50 chars)
+            previews = "\n".join(
+                f"💬 _{content[:NOTIFY_PREVIEW_CHARS]}{'...' if len(content) > NOTIFY_PREVIEW_CHARS else ''}_"
+                for content in contents
+            )
+            replied = "respondeu!" if len(contents) == 1 else f"respondeu {len(contents)} mensagens!"
 
-            notification = (
-                f"🔔 *Teste de Fidelidade*\n\n"
-                f"O numero {masked} respondeu!\n\n"
-                f"💬 _{preview}_\n\n"
-                f"Acesse o chat para ver:\n"
-                f"👉 {chat_url}"
+            notification = _OWNER_NOTIFICATION(
+                masked=masked, replied=replied, previews=previews, chat_url=chat_url
             )
 
             # Send via Cupido number (main UAZAPI), not the "woman" number
@@ -725,6 +811,7 @@ class FidelidadeService:
             supabase_service.client.table("fidelidade_tests").update({
                 "status": "expired",
             }).eq("id", test_id).execute()
+            self._invalidate_test(test_id)
             logger.info(f"Test {test_id} expired")
         except Exception as e:
             logger.error(f"Error expiring test: {e}")
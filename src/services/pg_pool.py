@@ -0,0 +1,173 @@
+"""
+Postgres Pool - Direct asyncpg access for hot read paths
+Bypasses PostgREST on high-frequency reads; writes stay on the Supabase client.
+"""
+import asyncio
+import json
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional
+
+import asyncpg
+
+from src.config import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Lost LISTEN connection: reconnect delay doubles from MIN up to MAX (seconds)
+LISTEN_RECONNECT_MIN_DELAY = 1.0
+LISTEN_RECONNECT_MAX_DELAY = 60.0
+
+
+def _to_json_safe(value: Any) -> Any:
+    """Convert asyncpg values to the same shapes PostgREST returns."""
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _record_to_dict(record: asyncpg.Record) -> Dict[str, Any]:
+    return {key: _to_json_safe(value) for key, value in record.items()}
+
+
+class PgPool:
+    """asyncpg connection pool over the Supabase pooler (Supavisor)."""
+
+    def __init__(self):
+        self.pool: Optional[asyncpg.Pool] = None
+        self._listen_conn: Optional[asyncpg.Connection] = None
+        # channel -> callback, re-registered after a reconnect
+        self._listeners: Dict[str, Callable[..., None]] = {}
+        self._reconnect_task: Optional[asyncio.Task] = None
+        # Set whenever the LISTEN connection is lost or (re)established
+        self.listen_state_changed = asyncio.Event()
+
+    @property
+    def available(self) -> bool:
+        return self.pool is not None
+
+    @property
+    def listen_configured(self) -> bool:
+        """LISTEN only runs on an explicit session-mode URL (transaction mode never delivers NOTIFY)."""
+        return bool(settings.SUPABASE_DB_LISTEN_URL)
+
+    @property
+    def listening(self) -> bool:
+        """Whether notifications are being received right now."""
+        return self._listen_conn is not None and not self._listen_conn.is_closed()
+
+    async def connect(self) -> None:
+        """Create the pool. Optional: without SUPABASE_DB_URL, reads go through PostgREST."""
+        if not settings.SUPABASE_DB_URL:
+            logger.info("SUPABASE_DB_URL not set - hot reads will use PostgREST")
+            return
+
+        try:
+            self.pool = await asyncpg.create_pool(
+                settings.SUPABASE_DB_URL,
+                min_size=settings.PG_POOL_MIN_SIZE,
+                max_size=settings.PG_POOL_MAX_SIZE,
+                # Supavisor (transaction mode) can't keep prepared statements per session
+                statement_cache_size=0,
+                prepared_statement_name_func=lambda: f"__s_{uuid.uuid4().hex}__",
+                init=self._init_connection,
+            )
+            logger.info("Postgres pool connected successfully")
+        except Exception as e:
+            logger.error(f"Failed to create Postgres pool, falling back to PostgREST: {e}")
+            self.pool = None
+
+    async def close(self) -> None:
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._listen_conn:
+            self._listen_conn.remove_termination_listener(self._on_listen_lost)
+            await self._listen_conn.close()
+            self._listen_conn = None
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    async def listen(self, channel: str, callback: Callable[..., None]) -> bool:
+        """
+        LISTEN on a channel over a dedicated connection (SUPABASE_DB_LISTEN_URL).
+        Returns whether it is listening now; a failed or lost connection is
+        retried in the background with backoff and the channel re-registered.
+        """
+        if not self.listen_configured:
+            return False
+
+        self._listeners[channel] = callback
+        try:
+            conn = await self._listen_connection()
+            await conn.add_listener(channel, callback)
+            logger.info(f"Listening on Postgres channel '{channel}'")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to LISTEN on '{channel}': {e}")
+            self._start_reconnect()
+            return False
+
+    async def _listen_connection(self) -> asyncpg.Connection:
+        if not self.listening:
+            self._listen_conn = await asyncpg.connect(settings.SUPABASE_DB_LISTEN_URL, statement_cache_size=0)
+            self._listen_conn.add_termination_listener(self._on_listen_lost)
+            self.listen_state_changed.set()
+        return self._listen_conn
+
+    def _on_listen_lost(self, conn: asyncpg.Connection) -> None:
+        logger.warning("Postgres LISTEN connection lost - reconnecting")
+        self._listen_conn = None
+        self.listen_state_changed.set()
+        self._start_reconnect()
+
+    def _start_reconnect(self) -> None:
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect_listen())
+
+    async def _reconnect_listen(self) -> None:
+        delay = LISTEN_RECONNECT_MIN_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                conn = await self._listen_connection()
+                for channel, callback in self._listeners.items():
+                    await conn.add_listener(channel, callback)
+                logger.info(f"Postgres LISTEN restored ({len(self._listeners)} channel(s))")
+                return
+            except Exception as e:
+                if self._listen_conn is not None:
+                    self._listen_conn.remove_termination_listener(self._on_listen_lost)
+                    self._listen_conn.terminate()
+                    self._listen_conn = None
+                delay = min(delay * 2, LISTEN_RECONNECT_MAX_DELAY)
+                logger.error(f"Postgres LISTEN reconnect failed, retrying in {delay:.0f}s: {e}")
+
+    @staticmethod
+    async def _init_connection(conn: asyncpg.Connection) -> None:
+        # Decode json/jsonb like PostgREST does
+        for pg_type in ("json", "jsonb"):
+            await conn.set_type_codec(
+                pg_type, encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
+            )
+
+    async def fetch(self, query: str, *args: Any) -> List[Dict[str, Any]]:
+        """Run a query and return rows as dicts."""
+        rows = await self.pool.fetch(query, *args)
+        return [_record_to_dict(row) for row in rows]
+
+    async def fetchrow(self, query: str, *args: Any) -> Optional[Dict[str, Any]]:
+        """Run a query and return the first row as a dict, or None."""
+        row = await self.pool.fetchrow(query, *args)
+        return _record_to_dict(row) if row else None
+
+
+# Global instance
+pg_pool = PgPool()
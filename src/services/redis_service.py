@@ -0,0 +1,94 @@
+"""
+Redis Service - Optional cache layer for Cupido
+Every method degrades to a no-op/miss when Redis is not configured or unreachable.
+"""
+from typing import Any, Awaitable, Callable, Optional, Union
+
+import orjson
+import redis.asyncio as redis
+
+from src.config import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class RedisService:
+    """Redis cache-aside helpers."""
+
+    def __init__(self):
+        self.redis_client: Optional[redis.Redis] = None
+
+    @property
+    def available(self) -> bool:
+        return self.redis_client is not None
+
+    async def connect(self) -> None:
+        """Connect to Redis. Optional: without REDIS_URL the cache is disabled."""
+        if not settings.REDIS_URL:
+            logger.info("REDIS_URL not set - cache disabled")
+            return
+
+        try:
+            # Raw bytes: cached values are orjson, which parses bytes without a decode step
+            client = redis.from_url(settings.REDIS_URL, decode_responses=False)
+            await client.ping()
+            self.redis_client = client
+            logger.info("Redis connected successfully")
+        except Exception as e:
+            logger.error(f"Failed to connect to Redis, cache disabled: {e}")
+            self.redis_client = None
+
+    async def close(self) -> None:
+        if self.redis_client:
+            await self.redis_client.aclose()
+            self.redis_client = None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if not self.available:
+            return None
+        try:
+            return await self.redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"Redis GET {key} failed: {e}")
+            return None
+
+    async def set(self, key: str, value: Union[str, bytes], ttl: int = 3600) -> None:
+        if not self.available:
+            return
+        try:
+            await self.redis_client.set(key, value, ex=ttl)
+        except Exception as e:
+            logger.warning(f"Redis SET {key} failed: {e}")
+
+    async def delete(self, *keys: str) -> None:
+        if not self.available or not keys:
+            return
+        try:
+            await self.redis_client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Redis DEL {keys} failed: {e}")
+
+    async def get_json(self, key: str) -> Any:
+        """GET a JSON value, or None on a miss."""
+        cached = await self.get(key)
+        return orjson.loads(cached) if cached is not None else None
+
+    async def set_json(self, key: str, value: Any, ttl: int = 3600) -> None:
+        await self.set(key, orjson.dumps(value), ttl)
+
+    async def get_or_set(self, key: str, ttl: int, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached JSON value for key, or load it, cache it (if truthy) and return it."""
+        cached = await self.get_json(key)
+        if cached is not None:
+            return cached
+
+        value = await loader()
+        # Empty/None results are not cached: they are also what loaders return on errors
+        if value:
+            await self.set_json(key, value, ttl)
+        return value
+
+
+# Global instance
+redis_service = RedisService()
@@ -1,12 +1,21 @@
 """
 Supabase Service - Database operations for Cupido
 """
-from typing import Any, Dict, List, Optional
+import asyncio
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
 
-from supabase import Client, create_client
+from cachetools import TTLCache
+from supabase import Client, ClientOptions, create_client
 
 from src.config import settings
+from src.services.pg_pool import pg_pool
+from src.services.redis_service import redis_service
+from src.utils.background import spawn
 from src.utils.logger import get_logger
+from src.utils.retry import retry_sync
 
 logger = get_logger(__name__)
 
@@ -19,56 +28,154 @@ class SupabaseService:
     TABLE_PRESENTATIONS = "cupido_presentations"
     BUCKET_ASSETS = "cupido-assets"
 
+    # Buffered presentation views are written every N seconds
+    VIEW_COUNT_FLUSH_SECONDS = 30
+
+    # In-process cache for get_order_by_token (form render -> submit in seconds)
+    # and get_order_by_sale_id (repeated Lowify deliveries of one sale)
+    ORDER_BY_TOKEN_CACHE_TTL = 5
+
+    # Presentations are never updated after creation; shared links get re-opened
+    PRESENTATION_CACHE_TTL = 300
+
+    # Redis cache for the /acesso order list (raw rows; plan rendering stays outside)
+    ORDERS_BY_PHONE_CACHE_TTL = 30
+
+    # Column projections for reads whose consumers use a few fields; the form and
+    # delivery paths read most of the row and keep select("*")
+    ORDER_LIST_COLUMNS = "id, plan, status, messages_sent, form_token, created_at"
+    PRESENTATION_COLUMNS = "id, title, slides"
+
+    # Due scheduled messages are fetched in keyset pages of this size
+    SCHEDULED_PAGE_SIZE = 200
+
+    # Failed sends are re-queued with backoff until this many attempts, then dropped
+    MAX_DELIVERY_ATTEMPTS = 5
+
+    # PostgREST request timeout (library default: 120s). Queries run on the bounded
+    # SUPABASE_THREADS pool, so a hung request would hold one of its threads that long
+    POSTGREST_TIMEOUT = 10
+
     def __init__(self):
-        self.client: Optional[Client] = None
+        self._client: Optional[Client] = None
+        self._client_lock = threading.Lock()
+        self.ready: bool = False
+        # presentation_id -> views not yet written
+        self._pending_views: Counter = Counter()
+        # form_token / sale_id -> order row, presentation_id -> row; read from
+        # request threads, hence the lock
+        self._order_by_token: TTLCache = TTLCache(maxsize=10_000, ttl=self.ORDER_BY_TOKEN_CACHE_TTL)
+        self._order_by_sale_id: TTLCache = TTLCache(maxsize=10_000, ttl=self.ORDER_BY_TOKEN_CACHE_TTL)
+        self._presentations: TTLCache = TTLCache(maxsize=1_000, ttl=self.PRESENTATION_CACHE_TTL)
+        self._cache_lock = threading.Lock()
+        # Public Storage URLs are deterministic: prefix + path
+        self._public_url_prefix = (
+            f"{settings.SUPABASE_URL.rstrip('/')}/storage/v1/object/public/{self.BUCKET_ASSETS}/"
+        )
+
+    @property
+    def client(self) -> Client:
+        """The process-wide Supabase client, created on first use."""
+        if self._client is None:
+            self.connect()
+        return self._client
 
     def connect(self) -> None:
-        """Connect to Supabase."""
-        try:
-            self.client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
-            logger.info("Supabase connected successfully")
-        except Exception as e:
-            logger.error(f"Failed to connect to Supabase: {e}")
-            raise
+        """Connect to Supabase (idempotent: later calls reuse the client)."""
+        if self._client is not None:
+            return
+        # Request threads may race the first access: build exactly one client
+        with self._client_lock:
+            if self._client is not None:
+                return
+            try:
+                # One client for the process: its PostgREST session keeps a pooled,
+                # keep-alive connection that every table()/rpc() call reuses
+                self._client = create_client(
+                    settings.SUPABASE_URL,
+                    settings.SUPABASE_KEY,
+                    options=ClientOptions(postgrest_client_timeout=self.POSTGREST_TIMEOUT),
+                )
+                self.ready = True
+                logger.info("Supabase connected successfully")
+            except Exception as e:
+                logger.error(f"Failed to connect to Supabase: {e}")
+                raise
 
     # ── Orders ────────────────────────────────────────────────────────
 
+    @staticmethod
+    def orders_by_phone_cache_key(phone: str) -> str:
+        return f"orders:phone:{phone}"
+
+    def _invalidate_order_caches(self, order: Dict[str, Any]) -> None:
+        """Drop cached copies of this order: by form token / sale_id, and its buyer's list (fire-and-forget)."""
+        with self._cache_lock:
+            if order.get("form_token"):
+                self._order_by_token.pop(order["form_token"], None)
+            if order.get("sale_id"):
+                self._order_by_sale_id.pop(order["sale_id"], None)
+        if redis_service.available and order.get("buyer_phone"):
+            spawn(redis_service.delete(self.orders_by_phone_cache_key(order["buyer_phone"])))
+
     def create_order(self, order_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Create a new Cupido order."""
         try:
-            response = self.client.table(self.TABLE_ORDERS).insert(order_data).execute()
+            response = retry_sync(self.client.table(self.TABLE_ORDERS).insert(order_data).execute)
             if response.data:
                 logger.info(f"Order created: {response.data[0]['id']}")
+                self._invalidate_order_caches(response.data[0])
                 return response.data[0]
             return None
         except Exception as e:
             logger.error(f"Error creating order: {e}")
             return None
 
-    def get_order_by_token(self, form_token: str) -> Optional[Dict[str, Any]]:
-        """Get order by form token."""
+    async def get_order_by_token(self, form_token: str) -> Optional[Dict[str, Any]]:
+        """Get order by form token (short in-process cache, dropped on writes; asyncpg when available)."""
+        with self._cache_lock:
+            cached = self._order_by_token.get(form_token)
+        if cached is not None:
+            return dict(cached)
+
         try:
-            response = (
-                self.client.table(self.TABLE_ORDERS)
-                .select("*")
-                .eq("form_token", form_token)
-                .limit(1)
-                .execute()
-            )
-            return response.data[0] if response.data else None
+            if pg_pool.available:
+                order = await pg_pool.fetchrow(
+                    f"SELECT * FROM {self.TABLE_ORDERS} WHERE form_token = $1 LIMIT 1",
+                    form_token,
+                )
+            else:
+                response = await asyncio.to_thread(
+                    self.client.table(self.TABLE_ORDERS)
+                    .select("*")
+                    .eq("form_token", form_token)
+                    .maybe_single()
+                    .execute
+                )
+                order = response.data if response else None
+            if order is None:
+                return None
+            with self._cache_lock:
+                self._order_by_token[form_token] = order
+            return dict(order)
         except Exception as e:
             logger.error(f"Error fetching order by token: {e}")
             return None
 
-    def get_orders_by_phone(self, phone: str) -> List[Dict[str, Any]]:
-        """Get all orders for a buyer phone number."""
+    async def get_orders_by_phone(self, phone: str) -> List[Dict[str, Any]]:
+        """Get the /acesso listing columns of a buyer's orders (hot read: asyncpg when available)."""
         try:
-            response = (
+            if pg_pool.available:
+                return await pg_pool.fetch(
+                    f"SELECT {self.ORDER_LIST_COLUMNS} FROM {self.TABLE_ORDERS} WHERE buyer_phone = $1 ORDER BY created_at DESC",
+                    phone,
+                )
+            response = await asyncio.to_thread(
                 self.client.table(self.TABLE_ORDERS)
-                .select("*")
+                .select(self.ORDER_LIST_COLUMNS)
                 .eq("buyer_phone", phone)
                 .order("created_at", desc=True)
-                .execute()
+                .execute
             )
             return response.data or []
         except Exception as e:
@@ -76,16 +183,27 @@ class SupabaseService:
             return []
 
     def get_order_by_sale_id(self, sale_id: str) -> Optional[Dict[str, Any]]:
-        """Get order by Lowify sale_id."""
+        """Get order by Lowify sale_id (short in-process cache, dropped on writes)."""
+        with self._cache_lock:
+            cached = self._order_by_sale_id.get(sale_id)
+        if cached is not None:
+            return dict(cached)
+
         try:
+            # sale_id is UNIQUE: a single-object response, None when absent
             response = (
                 self.client.table(self.TABLE_ORDERS)
                 .select("*")
                 .eq("sale_id", sale_id)
-                .limit(1)
+                .maybe_single()
                 .execute()
             )
-            return response.data[0] if response.data else None
+            if not response:
+                return None
+            order = response.data
+            with self._cache_lock:
+                self._order_by_sale_id[sale_id] = order
+            return dict(order)
         except Exception as e:
             logger.error(f"Error fetching order by sale_id: {e}")
             return None
@@ -101,18 +219,51 @@ class SupabaseService:
             )
             if response.data:
                 logger.info(f"Order {order_id} updated: {list(updates.keys())}")
+                self._invalidate_order_caches(response.data[0])
                 return response.data[0]
             return None
         except Exception as e:
             logger.error(f"Error updating order {order_id}: {e}")
             return None
 
+    def mark_order_delivered(self, order_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Mark an order delivered if none of its messages is still pending
+        (RPC mark_order_delivered). Returns the order, or None if not closed.
+        """
+        try:
+            response = self.client.rpc("mark_order_delivered", {"p_id": order_id}).execute()
+            if response.data:
+                logger.info(f"Order {order_id} fully delivered")
+                self._invalidate_order_caches(response.data[0])
+                return response.data[0]
+            return None
+        except Exception as e:
+            logger.error(f"Error marking order {order_id} as delivered: {e}")
+            return None
+
+    def mark_premium_delivered(self, order_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Close a premium order and flag its message entry delivered
+        (RPC mark_premium_delivered). Returns the order, or None on failure.
+        """
+        try:
+            response = self.client.rpc("mark_premium_delivered", {"p_id": order_id}).execute()
+            if response.data:
+                logger.info(f"Premium order {order_id} delivered")
+                self._invalidate_order_caches(response.data[0])
+                return response.data[0]
+            return None
+        except Exception as e:
+            logger.error(f"Error marking premium order {order_id} as delivered: {e}")
+            return None
+
     # ── Messages ──────────────────────────────────────────────────────
 
     def create_message(self, message_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Create a Cupido message."""
         try:
-            response = self.client.table(self.TABLE_MESSAGES).insert(message_data).execute()
+            response = retry_sync(self.client.table(self.TABLE_MESSAGES).insert(message_data).execute)
             if response.data:
                 return response.data[0]
             return None
@@ -120,20 +271,31 @@ class SupabaseService:
             logger.error(f"Error creating message: {e}")
             return None
 
-    def get_messages_by_order(self, order_id: str) -> List[Dict[str, Any]]:
-        """Get all messages for an order."""
+    def submit_message(
+        self, order_id: str, recipient_phone: str, message_data: Dict[str, Any], max_messages: int
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Save the next message of an order and update the order in one
+        transaction (RPC submit_message). Returns {"message", "order"}, or
+        None when the order has no message left or on error.
+        """
         try:
-            response = (
-                self.client.table(self.TABLE_MESSAGES)
-                .select("*")
-                .eq("order_id", order_id)
-                .order("message_index")
-                .execute()
-            )
-            return response.data or []
+            response = self.client.rpc("submit_message", {
+                "p_order_id": order_id,
+                "p_recipient": recipient_phone,
+                "p_content": message_data["content"],
+                "p_nickname": message_data.get("sender_nickname"),
+                "p_audio_text": message_data.get("audio_text"),
+                "p_scheduled_at": message_data.get("scheduled_at"),
+                "p_max_messages": max_messages,
+            }).execute()
+            if response.data:
+                self._invalidate_order_caches(response.data["order"])
+                return response.data
+            return None
         except Exception as e:
-            logger.error(f"Error fetching messages for order {order_id}: {e}")
-            return []
+            logger.error(f"Error submitting message for order {order_id}: {e}")
+            return None
 
     # ── Presentations ─────────────────────────────────────────────────
 
@@ -148,64 +310,176 @@ class SupabaseService:
             logger.error(f"Error creating presentation: {e}")
             return None
 
+    def submit_premium(
+        self, order_id: str, recipient_phone: str, title: str, slides: List[Dict[str, Any]],
+        sender_nickname: str, audio_text: Optional[str],
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Create the presentation + its message and mark the order submitted in
+        one transaction (RPC submit_premium). Returns {"presentation", "order"},
+        or None when the order was already submitted or on error.
+        """
+        try:
+            response = self.client.rpc("submit_premium", {
+                "p_order_id": order_id,
+                "p_recipient": recipient_phone,
+                "p_title": title,
+                "p_slides": slides,
+                "p_nickname": sender_nickname,
+                "p_audio_text": audio_text,
+            }).execute()
+            if response.data:
+                self._invalidate_order_caches(response.data["order"])
+                return response.data
+            return None
+        except Exception as e:
+            logger.error(f"Error submitting premium for order {order_id}: {e}")
+            return None
+
     def get_presentation(self, presentation_id: str) -> Optional[Dict[str, Any]]:
-        """Get a presentation by ID."""
+        """Get a presentation by ID (in-process cache: rows are immutable once created)."""
+        with self._cache_lock:
+            cached = self._presentations.get(presentation_id)
+        if cached is not None:
+            return cached
+
         try:
             response = (
                 self.client.table(self.TABLE_PRESENTATIONS)
-                .select("*")
+                .select(self.PRESENTATION_COLUMNS)
                 .eq("id", presentation_id)
-                .limit(1)
+                .maybe_single()
                 .execute()
             )
-            return response.data[0] if response.data else None
+            if not response:
+                return None
+            presentation = response.data
+            with self._cache_lock:
+                self._presentations[presentation_id] = presentation
+            return presentation
         except Exception as e:
             logger.error(f"Error fetching presentation {presentation_id}: {e}")
             return None
 
     def increment_view_count(self, presentation_id: str) -> None:
-        """Increment presentation view count."""
+        """Count a presentation view (buffered in memory, see flush_view_counts)."""
+        self._pending_views[presentation_id] += 1
+
+    async def flush_view_counts(self) -> None:
+        """Write buffered views in one RPC (bump_view_counts); kept for retry on failure."""
+        if not self._pending_views:
+            return
+        counts, self._pending_views = self._pending_views, Counter()
         try:
-            presentation = self.get_presentation(presentation_id)
-            if presentation:
-                new_count = (presentation.get("view_count") or 0) + 1
-                self.client.table(self.TABLE_PRESENTATIONS).update(
-                    {"view_count": new_count}
-                ).eq("id", presentation_id).execute()
+            await asyncio.to_thread(
+                self.client.rpc("bump_view_counts", {"p_counts": dict(counts)}).execute
+            )
         except Exception as e:
-            logger.error(f"Error incrementing view count: {e}")
+            logger.error(f"Error flushing view counts: {e}")
+            self._pending_views.update(counts)
 
-    def count_messages_by_order(self, order_id: str) -> int:
-        """Count messages for an order."""
+    async def get_pending_scheduled_messages(
+        self,
+        now_iso: str,
+        limit: int = SCHEDULED_PAGE_SIZE,
+        after: Optional[Tuple[str, str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Get one page of messages that are scheduled and past due for delivery,
+        ordered by (scheduled_at, id); pass the last row's (scheduled_at, id) as
+        `after` for the next page. Each row carries its order under "cupido_orders"
+        (RPC get_due_scheduled_messages).
+        """
+        after_at, after_id = after if after else (None, None)
         try:
-            response = (
-                self.client.table(self.TABLE_MESSAGES)
-                .select("id", count="exact")
-                .eq("order_id", order_id)
-                .execute()
+            if pg_pool.available:
+                rows = await pg_pool.fetch(
+                    "SELECT get_due_scheduled_messages AS row "
+                    "FROM get_due_scheduled_messages($1, $2, $3, $4)",
+                    datetime.fromisoformat(now_iso),
+                    limit,
+                    datetime.fromisoformat(after_at) if after_at else None,
+                    after_id,
+                )
+                return [r["row"] for r in rows]
+            response = await asyncio.to_thread(
+                self.client.rpc(
+                    "get_due_scheduled_messages",
+                    {"p_now": now_iso, "p_limit": limit, "p_after_at": after_at, "p_after_id": after_id},
+                ).execute
             )
-            return response.count or 0
+            return response.data or []
         except Exception as e:
-            logger.error(f"Error counting messages for order {order_id}: {e}")
-            return 0
+            logger.error(f"Error fetching scheduled messages: {e}")
+            return []
 
-    def get_pending_scheduled_messages(self, now_iso: str) -> List[Dict[str, Any]]:
-        """Get messages that are scheduled and past due for delivery."""
+    async def get_upcoming_scheduled_messages(self) -> List[Dict[str, Any]]:
+        """Get id + scheduled_at of every undelivered scheduled message (due or not)."""
         try:
-            response = (
+            if pg_pool.available:
+                return await pg_pool.fetch(
+                    f"SELECT id, scheduled_at FROM {self.TABLE_MESSAGES} "
+                    "WHERE delivered = FALSE AND scheduled_at IS NOT NULL"
+                )
+            response = await asyncio.to_thread(
                 self.client.table(self.TABLE_MESSAGES)
-                .select("*, cupido_orders!inner(id, plan, recipient_phone, buyer_phone, messages_sent, status)")
+                .select("id, scheduled_at")
                 .eq("delivered", False)
                 .not_.is_("scheduled_at", "null")
-                .lte("scheduled_at", now_iso)
-                .order("scheduled_at")
-                .execute()
+                .execute
             )
             return response.data or []
         except Exception as e:
-            logger.error(f"Error fetching scheduled messages: {e}")
+            logger.error(f"Error fetching upcoming scheduled messages: {e}")
             return []
 
+    def mark_messages_delivered(
+        self, deliveries: List[Dict[str, Optional[str]]]
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Mark a batch of messages delivered in one call (RPC mark_messages_delivered).
+        deliveries: [{"id": ..., "audio_url": ... or None}]. Orders left with no
+        pending message are closed in the same call; returns the closed orders,
+        or None when the write failed (the messages are still flagged undelivered).
+        """
+        if not deliveries:
+            return []
+        try:
+            # Re-flagging delivered messages is a no-op: safe to retry after a lost response
+            response = retry_sync(
+                self.client.rpc("mark_messages_delivered", {"p_messages": deliveries}).execute,
+                idempotent=True,
+            )
+            for order in response.data or []:
+                logger.info(f"Order {order['id']} fully delivered")
+                self._invalidate_order_caches(order)
+            return response.data or []
+        except Exception as e:
+            logger.error(f"Error marking {len(deliveries)} messages as delivered: {e}")
+            return None
+
+    def record_delivery_failures(self, message_ids: List[str]) -> None:
+        """
+        Count a failed send for each message and re-queue it for the scheduler with
+        backoff (RPC record_delivery_failures); past MAX_DELIVERY_ATTEMPTS it is dropped.
+        """
+        if not message_ids:
+            return
+        try:
+            response = self.client.rpc(
+                "record_delivery_failures",
+                {"p_ids": message_ids, "p_max_attempts": self.MAX_DELIVERY_ATTEMPTS},
+            ).execute()
+            for message in response.data or []:
+                if message.get("scheduled_at") is None:
+                    logger.error(
+                        f"Message {message['id']} failed {message['delivery_attempts']} times - giving up"
+                    )
+                else:
+                    logger.warning(f"Message {message['id']} re-queued for {message['scheduled_at']}")
+        except Exception as e:
+            logger.error(f"Error recording failed sends for {len(message_ids)} messages: {e}")
+
     def mark_message_delivered(self, message_id: str, audio_url: str = None) -> None:
         """Mark a message as delivered."""
         try:
@@ -218,23 +492,34 @@ class SupabaseService:
 
     # ── Storage ───────────────────────────────────────────────────────
 
-    def upload_file(self, file_path: str, file_bytes: bytes, content_type: str = "audio/mpeg") -> Optional[str]:
-        """Upload file to Supabase Storage and return public URL."""
+    def upload_file(
+        self, file_path: str, file_bytes: Union[bytes, BinaryIO], content_type: str = "audio/mpeg"
+    ) -> Optional[str]:
+        """
+        Upload file to Supabase Storage and return public URL.
+        file_bytes may also be an open binary file (FileIO/BufferedReader), sent without loading it.
+        """
         try:
             self.client.storage.from_(self.BUCKET_ASSETS).upload(
                 file_path,
                 file_bytes,
                 {"content-type": content_type},
             )
-            public_url = self.client.storage.from_(self.BUCKET_ASSETS).get_public_url(file_path)
+            public_url = self.get_public_url(file_path)
             logger.info(f"File uploaded: {file_path}")
             return public_url
         except Exception as e:
             logger.error(f"Error uploading file: {e}")
             return None
 
-    def upload_image(self, file_path: str, file_bytes: bytes, content_type: str = "image/jpeg") -> Optional[str]:
-        """Upload image to Supabase Storage and return public URL."""
+    def get_public_url(self, file_path: str) -> str:
+        """Public URL of a file in Supabase Storage (built locally, no request or client needed)."""
+        return f"{self._public_url_prefix}{file_path}"
+
+    def upload_image(
+        self, file_path: str, file_bytes: Union[bytes, BinaryIO], content_type: str = "image/jpeg"
+    ) -> Optional[str]:
+        """Upload image (bytes or open binary file) to Supabase Storage and return public URL."""
         return self.upload_file(file_path, file_bytes, content_type)
 
     def delete_file(self, file_path: str) -> bool:
@@ -2,15 +2,27 @@
 UAZAPI Service - WhatsApp messaging for Cupido
 """
 import asyncio
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
 import httpx
 
 from src.config import settings
 from src.utils.logger import get_logger
+from src.utils.retry import retry_async
+from src.utils.validators import strip_jid_suffix
 
 logger = get_logger(__name__)
 
+# Background outbox for fire-and-forget texts: bounded backlog, fixed senders
+OUTBOX_MAX_SIZE = 1000
+OUTBOX_WORKERS = 8
+
+# Shared HTTP client: keep-alive connections to the UAZAPI instance
+HTTP_TIMEOUT = 30.0
+PRESENCE_TIMEOUT = 10.0
+WARM_TIMEOUT = 5.0
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0)
+
 
 class UAZAPIService:
     """UAZAPI service for WhatsApp integration."""
@@ -18,27 +30,102 @@ class UAZAPIService:
     def __init__(self):
         self.base_url = settings.UAZAPI_BASE_URL
         self.token = settings.UAZAPI_TOKEN
+        self._outbox: Optional[asyncio.Queue] = None
+        self._outbox_workers: List[asyncio.Task] = []
+        self._client: Optional[httpx.AsyncClient] = None
+
+    # ── HTTP client ───────────────────────────────────────────────────
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Long-lived client, created on first use from the running loop."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=HTTP_TIMEOUT,
+                limits=HTTP_LIMITS,
+                headers={"Content-Type": "application/json", "token": self.token},
+            )
+        return self._client
+
+    def _token_headers(self, token: Optional[str]) -> Optional[Dict[str, str]]:
+        """Per-request header only for another instance's token; the default one is on the client."""
+        if not token or token == self.token:
+            return None
+        return {"token": token}
+
+    async def warm(self) -> None:
+        """Open a keep-alive connection (TLS included) before the first real send."""
+        try:
+            await self._get_client().head("/", timeout=WARM_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"UAZAPI warm-up failed: {e}")
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ── Outbox ────────────────────────────────────────────────────────
+
+    def start_outbox(self, workers: int = OUTBOX_WORKERS) -> None:
+        """Start the background senders (call from the running loop at startup)."""
+        self._outbox = asyncio.Queue(maxsize=OUTBOX_MAX_SIZE)
+        self._outbox_workers = [asyncio.create_task(self._outbox_worker()) for _ in range(workers)]
+
+    async def stop_outbox(self) -> None:
+        for task in self._outbox_workers:
+            task.cancel()
+        await asyncio.gather(*self._outbox_workers, return_exceptions=True)
+        self._outbox_workers = []
+        self._outbox = None
+
+    def enqueue_text(self, phone: str, text: str, token: str = None) -> bool:
+        """Queue a text for background sending. Returns False if it was dropped."""
+        if self._outbox is None:
+            logger.error(f"Outbox not started, dropping text to {phone[:7]}...")
+            return False
+        try:
+            self._outbox.put_nowait((phone, text, token))
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"Outbox full ({OUTBOX_MAX_SIZE}), dropping text to {phone[:7]}...")
+            return False
+
+    async def _outbox_worker(self) -> None:
+        while True:
+            item: Tuple[str, str, Optional[str]] = await self._outbox.get()
+            try:
+                await self.send_text(*item)
+            except Exception as e:
+                logger.error(f"Outbox send failed: {e}")
+            finally:
+                self._outbox.task_done()
+
+    # ── Messages ──────────────────────────────────────────────────────
 
     async def send_text(self, phone: str, text: str, token: str = None) -> Dict[str, Any]:
         """Send text message via WhatsApp."""
+        return await self._send_text_clean(strip_jid_suffix(phone), text, self._token_headers(token))
+
+    async def _send_text_clean(
+        self, phone_clean: str, text: str, headers: Optional[Dict[str, str]]
+    ) -> Dict[str, Any]:
+        """send_text for an already-stripped phone and resolved token headers."""
         try:
-            phone_clean = phone.replace("@s.whatsapp.net", "").replace("@c.us", "")
-            token = token or self.token
-
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/send/text",
-                    headers={"token": token, "Content-Type": "application/json"},
-                    json={
-                        "number": phone_clean,
-                        "text": text,
-                        "track_source": "cupido",
-                    },
-                )
-                response.raise_for_status()
-                data = response.json()
-                logger.info(f"Text sent to {phone_clean[:10]}...")
-                return {"success": True, "data": data}
+            # Not idempotent: only retried when the request never left
+            response = await retry_async(lambda: self._get_client().post(
+                "/send/text",
+                headers=headers,
+                json={
+                    "number": phone_clean,
+                    "text": text,
+                    "track_source": "cupido",
+                },
+            ))
+            response.raise_for_status()
+            data = response.json()
+            logger.info(f"Text sent to {phone_clean[:10]}...")
+            return {"success": True, "data": data}
 
         except Exception as e:
             logger.error(f"Error sending text: {e}")
@@ -47,68 +134,44 @@ class UAZAPIService:
     async def send_audio(self, phone: str, audio_url: str, token: str = None) -> Dict[str, Any]:
         """Send audio as voice message (PTT) via WhatsApp."""
         try:
-            phone_clean = phone.replace("@s.whatsapp.net", "").replace("@c.us", "")
-            token = token or self.token
-
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/send/media",
-                    headers={"token": token, "Content-Type": "application/json"},
-                    json={
-                        "number": phone_clean,
-                        "type": "ptt",
-                        "file": audio_url,
-                        "track_source": "cupido",
-                    },
-                )
-                response.raise_for_status()
-                data = response.json()
-                logger.info(f"Audio sent to {phone_clean[:10]}...")
-                return {"success": True, "data": data}
+            phone_clean = strip_jid_suffix(phone)
+
+            response = await retry_async(lambda: self._get_client().post(
+                "/send/media",
+                headers=self._token_headers(token),
+                json={
+                    "number": phone_clean,
+                    "type": "ptt",
+                    "file": audio_url,
+                    "track_source": "cupido",
+                },
+            ))
+            response.raise_for_status()
+            data = response.json()
+            logger.info(f"Audio sent to {phone_clean[:10]}...")
+            return {"success": True, "data": data}
 
         except Exception as e:
             logger.error(f"Error sending audio: {e}")
             return {"success": False, "error": str(e)}
 
-    async def send_multiple_messages(
-        self,
-        phone: str,
-        messages: List[str],
-        token: str = None,
-        delay_ms: int = 150,
-        typing_duration_ms: int = 2000,
-    ) -> List[Dict[str, Any]]:
-        """Send multiple messages with typing indicator between them."""
-        results = []
-        for i, text in enumerate(messages):
-            await self.send_presence(phone, token, "composing", delay_ms=typing_duration_ms)
-            await asyncio.sleep(typing_duration_ms / 1000.0)
-            result = await self.send_text(phone, text, token)
-            results.append(result)
-            if i < len(messages) - 1:
-                await asyncio.sleep(delay_ms / 1000.0)
-        return results
-
     async def send_presence(
         self, phone: str, token: str = None, presence_type: str = "composing", delay_ms: int = 3000
     ) -> Dict[str, Any]:
         """Send presence indicator (composing/recording/paused)."""
         try:
-            phone_clean = phone.replace("@s.whatsapp.net", "").replace("@c.us", "")
-            token = token or self.token
-
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/message/presence",
-                    headers={"token": token, "Content-Type": "application/json"},
-                    json={
-                        "number": phone_clean,
-                        "presence": presence_type,
-                        "delay": delay_ms,
-                    },
-                )
-                response.raise_for_status()
-                return {"success": True}
+            response = await self._get_client().post(
+                "/message/presence",
+                headers=self._token_headers(token),
+                json={
+                    "number": strip_jid_suffix(phone),
+                    "presence": presence_type,
+                    "delay": delay_ms,
+                },
+                timeout=PRESENCE_TIMEOUT,
+            )
+            response.raise_for_status()
+            return {"success": True}
 
         except Exception as e:
             logger.error(f"Error sending presence: {e}")
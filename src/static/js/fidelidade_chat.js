@@ -75,7 +75,7 @@
         messagesEl.innerHTML = messages.map(msg => {
             const isOut = msg.direction === 'outbound';
             const dirClass = isOut ? 'msg-outbound' : 'msg-inbound';
-            const blurClass = msg.blurred ? 'msg-blurred' : '';
+            const blurClass = isBlurred ? 'msg-blurred' : '';
             const time = new Date(msg.created_at).toLocaleTimeString('pt-BR', {
                 hour: '2-digit',
                 minute: '2-digit'
@@ -0,0 +1,41 @@
+"""
+Background tasks
+Fire-and-forget coroutines, kept referenced until done so they aren't garbage collected.
+"""
+import asyncio
+from typing import Any, Coroutine, Optional, Set
+
+_tasks: Set[asyncio.Task] = set()
+
+# The app's event loop, so sync code running in worker threads can spawn too
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def bind_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """Remember the app loop (call once at startup)."""
+    global _loop
+    _loop = loop
+
+
+def _create_task(coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+    task = asyncio.get_running_loop().create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def spawn(coro: Coroutine[Any, Any, Any]) -> Optional[asyncio.Task]:
+    """
+    Schedule a coroutine on the app loop without awaiting it.
+    From a worker thread (e.g. asyncio.to_thread) it is handed to the bound
+    loop and None is returned.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        if _loop is None:
+            coro.close()
+            raise RuntimeError("spawn() called outside the event loop before bind_loop()")
+        _loop.call_soon_threadsafe(_create_task, coro)
+        return None
+    return _create_task(coro)
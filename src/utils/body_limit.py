@@ -0,0 +1,86 @@
+"""
+Request body limits at the ASGI layer
+Oversize webhook/form bodies are rejected with 413 before any route parses them.
+"""
+from typing import Optional, Sequence, Tuple
+
+import orjson
+
+# (path prefix, path suffix, max bytes); first match wins
+BodyLimitRule = Tuple[str, str, int]
+
+_LIMITED_METHODS = frozenset({"POST", "PUT", "PATCH"})
+_TOO_LARGE_BODY = orjson.dumps({"detail": "Payload muito grande"})
+
+
+class BodyLimitMiddleware:
+    """Cap request body size on selected paths, by Content-Length and by bytes read."""
+
+    def __init__(self, app, rules: Sequence[BodyLimitRule]):
+        self.app = app
+        self.rules = tuple(rules)
+
+    def _limit_for(self, path: str) -> Optional[int]:
+        for prefix, suffix, max_bytes in self.rules:
+            if path.startswith(prefix) and path.endswith(suffix):
+                return max_bytes
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in _LIMITED_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self._limit_for(scope["path"])
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if not value.isdigit() or int(value) > max_bytes:
+                    await self._reject(send)
+                    return
+                break
+
+        # Chunked or lying clients: read with a running total, the limit bounds the buffer
+        chunks = []
+        total = 0
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                # Client went away before the body finished
+                return
+            chunk = message.get("body", b"")
+            total += len(chunk)
+            if total > max_bytes:
+                await self._reject(send)
+                return
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                break
+
+        body = b"".join(chunks)
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay_receive, send)
+
+    @staticmethod
+    async def _reject(send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(_TOO_LARGE_BODY)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": _TOO_LARGE_BODY})
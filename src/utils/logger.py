@@ -7,36 +7,32 @@ from typing import Optional
 
 from loguru import logger
 
+from src.config import settings
 
-def get_logger(name: Optional[str] = None):
-    """
-    Get configured logger instance.
+_configured = False
 
-    Args:
-        name: Logger name (optional)
+CONSOLE_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
+    "<level>{level: <8}</level> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | "
+    "<level>{message}</level>"
+)
 
-    Returns:
-        Logger instance
 
-    Example:
-        >>> logger = get_logger(__name__)
-        >>> logger.info("Processing message")
-    """
+def _configure() -> None:
+    """Install the sinks once. enqueue=True: formatting and writes happen on loguru's worker thread."""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+
     # Remove default handler
     logger.remove()
 
-    # Add custom handler with colors
-    logger.add(
-        sys.stdout,
-        colorize=True,
-        format=(
-            "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
-            "<level>{level: <8}</level> | "
-            "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | "
-            "<level>{message}</level>"
-        ),
-        level="INFO",
-    )
+    if settings.LOG_JSON:
+        logger.add(sys.stdout, serialize=True, level="INFO", enqueue=True)
+    else:
+        logger.add(sys.stdout, colorize=True, format=CONSOLE_FORMAT, level="INFO", enqueue=True)
 
     # Add file handler for errors
     logger.add(
@@ -45,8 +41,26 @@ def get_logger(name: Optional[str] = None):
         retention="1 week",
         level="ERROR",
         format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} | {message}",
+        enqueue=True,
     )
 
+
+def get_logger(name: Optional[str] = None):
+    """
+    Get configured logger instance.
+
+    Args:
+        name: Logger name (optional)
+
+    Returns:
+        Logger instance
+
+    Example:
+        >>> logger = get_logger(__name__)
+        >>> logger.info("Processing message")
+    """
+    _configure()
+
     if name:
         return logger.bind(name=name)
 
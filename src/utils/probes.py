@@ -0,0 +1,31 @@
+"""
+Probe responses at the ASGI layer
+Liveness/health probes are answered with precomputed bytes before routing.
+"""
+from typing import Any, Dict
+
+import orjson
+
+
+class ProbeMiddleware:
+    """Answer GET requests on fixed probe paths with a static JSON body."""
+
+    def __init__(self, app, responses: Dict[str, Dict[str, Any]]):
+        self.app = app
+        self.responses = {path: orjson.dumps(body) for path, body in responses.items()}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "GET":
+            body = self.responses.get(scope["path"])
+            if body is not None:
+                await send({
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
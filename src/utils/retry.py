@@ -0,0 +1,80 @@
+"""
+Retry with backoff for transient Supabase/UAZAPI errors
+Non-idempotent calls only retry when the request never reached the server.
+"""
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, TypeVar
+
+import httpx
+from postgrest.exceptions import APIError
+
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Attempts after the first one; delays are full-jitter exponential
+MAX_RETRIES = 3
+BASE_DELAY = 0.1
+MAX_DELAY = 2.0
+
+# Connection never established: nothing was sent, safe to retry any call
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Sent but no usable answer: the server may have applied it, idempotent calls only
+_MAYBE_SENT_ERRORS = (httpx.ReadTimeout, httpx.ReadError, httpx.RemoteProtocolError)
+# Transient PostgREST errors, idempotent calls only: gateway statuses (a non-JSON
+# error body carries the HTTP status as its code) and PGRST000-002 (PostgREST
+# could not reach the database)
+_TRANSIENT_API_CODES = frozenset({"502", "503", "504", "PGRST000", "PGRST001", "PGRST002"})
+
+
+def is_transient_error(error: Exception, idempotent: bool = False) -> bool:
+    """Whether retrying the call that raised error can succeed without side effects."""
+    if isinstance(error, _NOT_SENT_ERRORS):
+        return True
+    if not idempotent:
+        return False
+    if isinstance(error, _MAYBE_SENT_ERRORS):
+        return True
+    if isinstance(error, APIError):
+        return str(error.code) in _TRANSIENT_API_CODES
+    return False
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt)))
+
+
+def retry_sync(fn: Callable[[], T], *, idempotent: bool = False, max_retries: int = MAX_RETRIES) -> T:
+    """Call fn(), retrying transient errors (for sync Supabase calls, run in worker threads)."""
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_transient_error(e, idempotent):
+                raise
+            delay = _backoff(attempt)
+            attempt += 1
+            logger.warning(f"Transient error ({type(e).__name__}), retry {attempt} in {delay:.2f}s")
+            time.sleep(delay)
+
+
+async def retry_async(
+    factory: Callable[[], Awaitable[T]], *, idempotent: bool = False, max_retries: int = MAX_RETRIES
+) -> T:
+    """Await factory(), retrying transient errors; factory builds a fresh awaitable per attempt."""
+    attempt = 0
+    while True:
+        try:
+            return await factory()
+        except Exception as e:
+            if attempt >= max_retries or not is_transient_error(e, idempotent):
+                raise
+            delay = _backoff(attempt)
+            attempt += 1
+            logger.warning(f"Transient error ({type(e).__name__}), retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
@@ -0,0 +1,23 @@
+"""
+Templating
+Shared Jinja2 environment for all HTML routes.
+"""
+import jinja2
+from fastapi.templating import Jinja2Templates
+
+from src.config import settings
+
+TEMPLATES_DIR = "src/templates"
+
+_is_production = settings.ENVIRONMENT == "production"
+
+env = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
+    autoescape=True,
+    # Templates only change on deploy: skip the per-render mtime check in production
+    auto_reload=not _is_production,
+    # Compiled templates survive restarts (per-user dir under the system temp dir)
+    bytecode_cache=jinja2.FileSystemBytecodeCache() if _is_production else None,
+)
+
+templates = Jinja2Templates(env=env)
@@ -1,34 +1,90 @@
 """
 Input Validators for Cupido
-Phone validation and normalization utilities
+Phone and email normalization utilities, timestamp parsing
 """
 import re
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+
+# WhatsApp suffixes (@s.whatsapp.net, @c.us) have no digits, so stripping
+# non-digits removes them too
+_NON_DIGITS = re.compile(r"\D+")
+_JID_SUFFIX = re.compile(r"@s\.whatsapp\.net|@c\.us")
+# ASCII input (nearly all of it) drops non-digits via str.translate, ~2x the regex
+_DROP_ASCII_NON_DIGITS = str.maketrans("", "", "".join(chr(c) for c in range(128) if not chr(c).isdigit()))
+
+_UTC = timezone.utc
+
+# Repeat senders (webhook bursts, follow-ups to the same target) hit the cache
+PHONE_CACHE_SIZE = 4096
+# Polled rows (chat expiry checks) repeat the same timestamps
+TIMESTAMP_CACHE_SIZE = 4096
+
+
+def _digits(phone: str) -> str:
+    """Keep only the digits of phone."""
+    if phone.isascii():
+        return phone.translate(_DROP_ASCII_NON_DIGITS)
+    return _NON_DIGITS.sub("", phone)
+
+
+def _with_country_code(digits: str) -> str:
+    """Ensure Brazil country code."""
+    if len(digits) in (10, 11):  # DDD + 8 digits (landline) / DDD + 9 digits
+        return f"55{digits}"
+    return digits
+
+
+def parse_phone(phone: str) -> Optional[str]:
+    """Validate and clean in one pass: UAZAPI-ready digits, or None if invalid (10-15 digits)."""
+    if not phone:
+        return None
+    digits = _digits(phone)
+    if not 10 <= len(digits) <= 15:
+        return None
+    return _with_country_code(digits)
 
 
 def validate_phone(phone: str) -> bool:
     """Validate phone number format (10-15 digits)."""
     if not phone:
         return False
-    phone_clean = phone.replace("@s.whatsapp.net", "").replace("@c.us", "")
-    phone_clean = re.sub(r"[^\d]", "", phone_clean)
-    return 10 <= len(phone_clean) <= 15
+    return 10 <= len(_digits(phone)) <= 15
 
 
 def normalize_phone(phone: str) -> str:
     """Normalize phone to WhatsApp format (e.g. 5585999999999@s.whatsapp.net)."""
     if "@" in phone:
         return phone
-    phone_clean = re.sub(r"[^\d]", "", phone)
-    return f"{phone_clean}@s.whatsapp.net"
+    return f"{_digits(phone)}@s.whatsapp.net"
 
 
+def strip_jid_suffix(phone: str) -> str:
+    """Drop WhatsApp JID suffixes, keeping everything else as-is."""
+    if "@" not in phone:
+        return phone
+    return _JID_SUFFIX.sub("", phone)
+
+
+@lru_cache(maxsize=PHONE_CACHE_SIZE)
 def clean_phone_for_whatsapp(phone: str) -> str:
     """Clean phone number for UAZAPI (digits only, no suffix)."""
-    phone_clean = phone.replace("@s.whatsapp.net", "").replace("@c.us", "")
-    phone_clean = re.sub(r"[^\d]", "", phone_clean)
-    # Ensure Brazil country code
-    if len(phone_clean) == 11:  # DDD + 9 digits
-        phone_clean = f"55{phone_clean}"
-    elif len(phone_clean) == 10:  # DDD + 8 digits (landline)
-        phone_clean = f"55{phone_clean}"
-    return phone_clean
+    return _with_country_code(_digits(phone))
+
+
+def normalize_email(email: str) -> str:
+    """Canonical email form (trimmed, lowercase) as stored in fidelidade_users."""
+    return email.strip().lower()
+
+
+def parse_utc_datetime(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp ("Z" suffix allowed); naive values are taken as UTC. Raises ValueError."""
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=_UTC)
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_utc_timestamp(value: str) -> float:
+    """Like parse_utc_datetime, as epoch seconds (compare against time.time()). Raises ValueError."""
+    return parse_utc_datetime(value).timestamp()